@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""Compare the gradients and the peak memory of a deep Linear chain with and without gradient checkpointing.
+
+The gradients computed by "setup_checkpointed()" should be the same as those of "setup()" (up to float rounding),
+and the peak memory of the backward pass should be lower.
+The peak memory is the max "allocator_bytes_in_use" over the nodes in the step stats of a traced run, i.e., the
+live bytes of the allocator (including the parameters, which are the same in both modes) when each op finished.
+It is reported for each device and allocator, e.g., "/job:localhost/replica:0/task:0/device:GPU:0 GPU_0_bfc".
+(The "peak_bytes" of a node is only the high-water mark of that op's own allocations, so it is not used.)
+The allocators that do not report the bytes in use (e.g., the CPU allocator without allocator stats) are skipped.
+
+Usage:
+
+    python3 benchmarks/checkpointing.py --depth 64 --batch-size 512 --hidden-size 1024
+
+@author: xi
+@since: 2026-10-18
+"""
+
+import argparse
+import collections
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import photinia as ph
+
+
+def peak_bytes_in_use(run_metadata):
+    """Get the max bytes in use of each allocator during a traced run.
+
+    :param run_metadata: tf.RunMetadata of a run with FULL_TRACE.
+    :return: dict[(device, allocator_name), int].
+    """
+    peaks = collections.defaultdict(int)
+    for dev_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            for memory in node_stats.memory:
+                key = (dev_stats.device, memory.allocator_name)
+                peaks[key] = max(peaks[key], memory.allocator_bytes_in_use)
+    return {key: value for key, value in peaks.items() if value > 0}
+
+
+def main(args):
+    with tf.Graph().as_default():
+        x = tf.placeholder(ph.D_TYPE, (None, args.hidden_size), name='x')
+        layers = [ph.Linear('linear_%d' % i, args.hidden_size, args.hidden_size) for i in range(args.depth)]
+        widget_list = [w for layer in layers for w in (layer, tf.nn.tanh)]
+        var_list = [var for layer in layers for var in layer.get_trainable_variables()]
+        grads_dict = collections.OrderedDict()
+        for name, setup_fn in (('plain', ph.setup), ('checkpointed', ph.setup_checkpointed)):
+            y = setup_fn(x, widget_list)
+            loss = tf.reduce_mean(tf.square(y))
+            grads_dict[name] = tf.gradients(loss, var_list)
+
+        x_value = np.random.uniform(-1, 1, (args.batch_size, args.hidden_size)).astype(np.float32)
+        with tf.Session() as session:
+            session.run(tf.global_variables_initializer())
+            #
+            # Both in one run, so that they see the same inputs and parameters.
+            plain_grads, checkpointed_grads = session.run(list(grads_dict.values()), feed_dict={x: x_value})
+            max_diff = max(np.max(np.abs(a - b)) for a, b in zip(plain_grads, checkpointed_grads))
+            max_grad = max(np.max(np.abs(a)) for a in plain_grads)
+            print('max abs grad: %.6g, max abs diff: %.6g' % (max_grad, max_diff))
+
+            print('%-16s%12s%16s  %s' % ('mode', 'time(s)', 'peak(MB)', 'device allocator'))
+            options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            for name, grads in grads_dict.items():
+                session.run(grads, feed_dict={x: x_value})  # warm up
+                run_time = float('inf')
+                for _ in range(args.repeat):
+                    start = time.time()
+                    session.run(grads, feed_dict={x: x_value})
+                    run_time = min(run_time, time.time() - start)
+                run_metadata = tf.RunMetadata()
+                session.run(grads, feed_dict={x: x_value}, options=options, run_metadata=run_metadata)
+                peaks = peak_bytes_in_use(run_metadata)
+                if not peaks:
+                    print('%-16s%12.4f%16s  %s' % (name, run_time, 'n/a', 'no allocator reported bytes in use'))
+                for (device, allocator), size in sorted(peaks.items()):
+                    print('%-16s%12.4f%16.1f  %s %s' % (name, run_time, size / 2 ** 20, device, allocator))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--depth', type=int, default=64, help='Number of Linear layers.')
+    parser.add_argument('--batch-size', type=int, default=512, help='Batch size.')
+    parser.add_argument('--hidden-size', type=int, default=1024, help='Hidden size.')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeat times. The best one is reported.')
+    exit(main(parser.parse_args()))
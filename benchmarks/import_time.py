@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""Benchmark the import time of photinia.
+
+The script exits with a non-zero code if the import time exceeds the given limit, or if a heavy dependency is
+imported by a light statement. So it can be used as a regression gate in CI:
+
+    python3 benchmarks/import_time.py --max-seconds 0.5
+
+@author: xi
+@since: 2026-10-18
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ('tensorflow', 'pymongo', 'gridfs', 'scipy', 'PIL')
+
+#
+# These statements should never import the heavy dependencies.
+LIGHT_STATEMENTS = (
+    'import photinia',
+    'import photinia.persistence',
+    'from photinia import FileDumper, TreeDumper',
+    'from photinia import Dataset'
+)
+
+_PROBE = '''
+import json
+import sys
+import time
+start = time.time()
+exec(sys.argv[1])
+elapsed = time.time() - start
+heavy = sorted({name.split('.')[0] for name in sys.modules} & set(sys.argv[2].split(',')))
+print(json.dumps({'time': elapsed, 'heavy': heavy}))
+'''
+
+
+def probe(statement):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    output = subprocess.check_output(
+        [sys.executable, '-c', _PROBE, statement, ','.join(HEAVY_MODULES)],
+        env=env
+    )
+    return json.loads(output.decode().strip().split('\n')[-1])
+
+
+def main(args):
+    failed = False
+    print('%-48s%12s  %s' % ('statement', 'time(s)', 'heavy modules'))
+    for statement in LIGHT_STATEMENTS:
+        results = [probe(statement) for _ in range(args.repeat)]
+        elapsed = min(result['time'] for result in results)
+        heavy = results[0]['heavy']
+        print('%-48s%12.4f  %s' % (statement, elapsed, ','.join(heavy)))
+        if heavy or elapsed > args.max_seconds:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-seconds', type=float, default=0.5, help='Max import time of each statement.')
+    parser.add_argument('--repeat', type=int, default=5, help='Repeat times. The best one is reported.')
+    exit(main(parser.parse_args()))
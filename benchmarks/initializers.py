@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+"""Benchmark the build time and the GraphDef size of the initializers.
+
+Usage:
+
+    python3 benchmarks/initializers.py --size 4096
+
+@author: xi
+@since: 2026-10-18
+"""
+
+import argparse
+import time
+
+import tensorflow as tf
+
+import photinia as ph
+
+
+def benchmark(init, size):
+    with tf.Graph().as_default():
+        start = time.time()
+        var = tf.Variable(init.build(shape=(size, size)), dtype=ph.D_TYPE, name='w')
+        build_time = time.time() - start
+        graph_def_size = tf.get_default_graph().as_graph_def().ByteSize()
+        with tf.Session() as session:
+            start = time.time()
+            session.run(var.initializer)
+            init_time = time.time() - start
+    return build_time, graph_def_size, init_time
+
+
+def main(args):
+    inits = [
+        ('Orthogonal', ph.Orthogonal()),
+        ('Identity', ph.Identity()),
+        ('GlorotUniform', ph.GlorotUniform())
+    ]
+    print('%-16s%12s%16s%12s' % ('initializer', 'build(s)', 'graph_def(B)', 'init(s)'))
+    for name, init in inits:
+        build_time, graph_def_size, init_time = benchmark(init, args.size)
+        print('%-16s%12.4f%16d%12.4f' % (name, build_time, graph_def_size, init_time))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=4096, help='Size of the square matrix.')
+    exit(main(parser.parse_args()))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""Benchmark the throughput of loading large JPEG images with and without the reduced-size (draft) decoding.
+
+A directory of synthetic large JPEG images is generated first:
+
+    python3 benchmarks/jpeg_decode.py --num-images 32 --source-size 3000 2000 --target-size 224 224
+
+@author: xi
+@since: 2026-10-18
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from photinia.utils import images
+
+
+def make_images(image_dir, num_images, width, height):
+    rows, cols = np.mgrid[0:height, 0:width]
+    for i in range(num_images):
+        #
+        # Smooth gradients with some noise, so that the JPEG size is realistic.
+        array = np.stack((
+            (rows * 255 // height + i * 7) % 256,
+            (cols * 255 // width + i * 13) % 256,
+            ((rows + cols) * 255 // (height + width) + i * 17) % 256
+        ), axis=-1).astype(np.int16)
+        array += np.random.randint(-8, 9, size=array.shape, dtype=np.int16)
+        image = Image.fromarray(np.clip(array, 0, 255).astype(np.uint8))
+        image.save(os.path.join(image_dir, '%04d.jpg' % i), quality=90)
+
+
+def benchmark(file_list, height, width, resample, draft, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.time()
+        for file_ in file_list:
+            images.load_as_array(file_, height, width, resample, draft)
+        best = min(best, time.time() - start)
+    return len(file_list) / best
+
+
+def main(args):
+    image_dir = tempfile.mkdtemp(prefix='jpeg_decode_')
+    try:
+        make_images(image_dir, args.num_images, args.source_size[0], args.source_size[1])
+        file_list = [os.path.join(image_dir, file_) for file_ in sorted(os.listdir(image_dir))]
+        width, height = args.target_size
+        print('%-12s%8s%16s' % ('resample', 'draft', 'images/s'))
+        for name, resample in (('LANCZOS', Image.LANCZOS), ('BILINEAR', Image.BILINEAR)):
+            for draft in (False, True):
+                throughput = benchmark(file_list, height, width, resample, draft, args.repeat)
+                print('%-12s%8s%16.2f' % (name, draft, throughput))
+    finally:
+        shutil.rmtree(image_dir)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-images', type=int, default=32, help='Number of synthetic images.')
+    parser.add_argument('--source-size', type=int, nargs=2, default=[3000, 2000], help='Source width and height.')
+    parser.add_argument('--target-size', type=int, nargs=2, default=[224, 224], help='Target width and height.')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeat times. The best one is reported.')
+    exit(main(parser.parse_args()))
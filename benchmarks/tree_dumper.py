@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""Benchmark the dump and load time of TreeDumper with different numbers of workers.
+
+The benchmark runs on a tmpfs directory (where the latency of file operations is low) and on a disk directory.
+To benchmark a network filesystem, pass its mount point with "--dirs":
+
+    python3 benchmarks/tree_dumper.py --num-tensors 300 --dirs /dev/shm /tmp /mnt/nfs
+
+@author: xi
+@since: 2026-10-18
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import photinia as ph
+
+
+def make_params(num_tensors, tensor_size):
+    return {
+        'model/layer_%d/w:0' % i: np.random.uniform(size=(tensor_size,)).astype(np.float32)
+        for i in range(num_tensors)
+    }
+
+
+def benchmark(root_dir, param_dict, num_workers, repeat):
+    output_dir = tempfile.mkdtemp(prefix='tree_dumper_', dir=root_dir)
+    try:
+        dumper = ph.TreeDumper(output_dir, num_workers=num_workers)
+        dump_time = load_time = float('inf')
+        for _ in range(repeat):
+            start = time.time()
+            dumper.dump_params(param_dict, 'model', atomic=False)
+            dump_time = min(dump_time, time.time() - start)
+            start = time.time()
+            dumper._load('model')
+            load_time = min(load_time, time.time() - start)
+    finally:
+        shutil.rmtree(output_dir)
+    return dump_time, load_time
+
+
+def main(args):
+    param_dict = make_params(args.num_tensors, args.tensor_size)
+    print('%-24s%10s%12s%12s' % ('dir', 'workers', 'dump(s)', 'load(s)'))
+    for root_dir in args.dirs:
+        if not os.path.isdir(root_dir):
+            print('%-24s  skipped (not a directory)' % root_dir)
+            continue
+        for num_workers in args.workers:
+            dump_time, load_time = benchmark(root_dir, param_dict, num_workers, args.repeat)
+            print('%-24s%10d%12.4f%12.4f' % (root_dir, num_workers, dump_time, load_time))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-tensors', type=int, default=300, help='Number of tensors.')
+    parser.add_argument('--tensor-size', type=int, default=65536, help='Number of elements of each tensor.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16], help='Numbers of workers.')
+    parser.add_argument('--dirs', nargs='+', default=['/dev/shm', '.'], help='Directories to benchmark (tmpfs, disk).')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeat times. The best one is reported.')
+    exit(main(parser.parse_args()))
@@ -27,7 +27,8 @@ class Model(photinia.Trainer):
                  session,
                  voc_size,
                  emb_size,
-                 state_size):
+                 state_size,
+                 num_sampled=64):
         """模型初始化
 
         :param name: 模型名
@@ -35,24 +36,26 @@ class Model(photinia.Trainer):
         :param voc_size: 字典维度
         :param emb_size: 词embedding维度
         :param state_size: GRU单元隐藏单元维度
+        :param num_sampled: 训练时sampled softmax的采样数
         """
         self._voc_size = voc_size
         self._emb_size = emb_size
         self._state_size = state_size
+        self._num_sampled = num_sampled
         photinia.Trainer.__init__(self, name, session)
 
     def _build(self):
         # 网络模块定义 --- build
-        self._emb = photinia.Linear('EMB', self._voc_size, self._emb_size)
+        self._emb = photinia.Embedding('EMB', self._voc_size, self._emb_size)
         self._cell = photinia.GRUCell('CELL', self._emb_size, self._state_size)
-        self._lin = photinia.Linear('LIN', self._state_size, self._voc_size)
-        # 输入定义
+        self._out = photinia.SampledSoftmax('OUT', self._state_size, self._voc_size, self._num_sampled)
+        # 输入定义（词的下标序列）
         seq = tf.placeholder(
-            shape=(None, None, self._voc_size),
-            dtype=photinia.D_TYPE
+            shape=(None, None),
+            dtype=tf.int32
         )
-        seq_0 = seq[:, :-1, :]
-        seq_1 = seq[:, 1:, :]
+        seq_0 = seq[:, :-1]
+        seq_1 = seq[:, 1:]
         batch_size = tf.shape(seq)[0]
         # RNN结构
         init_state = tf.zeros(
@@ -61,22 +64,16 @@ class Model(photinia.Trainer):
         )
         states = tf.scan(
             fn=self._rnn_step,
-            elems=tf.transpose(seq_0, (1, 0, 2)),
+            elems=tf.transpose(seq_0, (1, 0)),
             initializer=init_state
         )
-        probs = tf.map_fn(
-            fn=self._state_to_prob,
-            elems=states
-        )
-        outputs = tf.map_fn(
-            fn=self._prob_to_output,
-            elems=probs
-        )
-        probs = tf.transpose(probs, (1, 0, 2))
-        outputs = tf.transpose(outputs, (1, 0, 2))
-        outputs = tf.concat((seq[:, 0:1, :], outputs), 1)
-        loss = tf.reduce_mean(-tf.log(1e-5 + tf.reduce_sum(seq_1 * probs, 2)), 1)
-        loss = tf.reduce_mean(loss)
+        states = tf.transpose(states, (1, 0, 2))
+        # 训练时只在采样的候选词上计算softmax
+        loss = tf.reduce_mean(self._out.setup(states, seq_1))
+        # 预测时对所有时刻一次性计算完整的softmax
+        logits = self._out.setup(states)
+        outputs = tf.cast(tf.argmax(logits, 2), tf.int32)
+        outputs = tf.concat((seq[:, 0:1], outputs), 1)
         self._add_slot(
             'train',
             outputs=loss,
@@ -90,8 +87,8 @@ class Model(photinia.Trainer):
         )
         #
         word = tf.placeholder(
-            shape=(None, self._voc_size),
-            dtype=photinia.D_TYPE
+            shape=(None,),
+            dtype=tf.int32
         )
         emb = self._emb.setup(word)
         emb = photinia.lrelu(emb)
@@ -107,15 +104,6 @@ class Model(photinia.Trainer):
         state = self._cell.setup(emb, acc)
         return state
 
-    def _state_to_prob(self, state):
-        prob = self._lin.setup(state)
-        prob = photinia.lrelu(prob)
-        prob = tf.nn.softmax(prob)
-        return prob
-
-    def _prob_to_output(self, prob):
-        return tf.one_hot(tf.arg_max(prob, 1), self._voc_size)
-
 
 class PTBData(photinia.DataSource):
     """数据源定义
@@ -179,20 +167,18 @@ class PTBData(photinia.DataSource):
         return self._itow
 
     def encode(self, text):
-        length = len(text)
-        mat = np.zeros(shape=(length, self.voc_size), dtype=np.float32)
-        for i, word in enumerate(text):
-            if word in self._wtoi:
-                mat[i][self._wtoi[word]] = 1.
-            else:
-                mat[i][self._wtoi['<unk>']] = 1.
-        return mat
+        return self.encode_batch([text])[0]
+
+    def encode_batch(self, batch):
+        # 同一批中的句子长度相同，直接把id写入一个数组
+        get = self._wtoi.get
+        unk = self._wtoi['<unk>']
+        ids = np.fromiter((get(word, unk) for text in batch for word in text), dtype=np.int32)
+        return ids.reshape((len(batch), -1))
 
-    def decode(self, mat):
+    def decode(self, ids):
         text = []
-        for i in range(len(mat)):
-            row = mat[i]
-            index = np.argmax(row)
+        for index in ids:
             word = self._itow[index]
             if word == '\n':
                 break
@@ -202,7 +188,7 @@ class PTBData(photinia.DataSource):
     def next_batch(self, size=0):
         key = np.random.choice(list(self._groups.keys()))
         batch, = self._groups[key].next_batch(size)
-        return np.array([self.encode(text) for text in batch], dtype=np.float32)
+        return self.encode_batch(batch)
 
 
 def main(flags):
@@ -225,7 +211,8 @@ def main(flags):
             session,
             ds.voc_size,
             flags.emb_size,
-            flags.state_size
+            flags.state_size,
+            flags.num_sampled
         )
         # 获取slot
         train = model.get_slot('train')
@@ -272,6 +259,7 @@ if __name__ == '__main__':
     gflags.DEFINE_integer('max_len', 40, 'Max length.')
     gflags.DEFINE_integer('emb_size', 100, 'Embedding size.')
     gflags.DEFINE_integer('state_size', 1000, 'State size.')
+    gflags.DEFINE_integer('num_sampled', 64, 'Number of sampled words for the softmax.')
     gflags.DEFINE_integer('interval', 1000, 'Interval of save the word\'s embedding.')
     global_flags(sys.argv)
     if global_flags.help:
@@ -3,16 +3,94 @@
 """
 @author: xi
 @since: 2017-04-08
+
+The submodules are imported lazily, on the first access of their attributes (e.g., "photinia.Linear").
+So "import photinia" (or "import photinia.persistence") does not import TensorFlow and the other heavy
+dependencies until they are actually used.
+The names are resolved as if the submodules were imported with "from .submodule import *" in the order of
+_SUBMODULES.
 """
 
-from .settings import *
-from .data import *
-from .deprecated import *
-from .initializers import *
-from .operations import *
-from .persistence import *
-from .regularizers import *
-from .training import *
-from .widgets import *
-from . import utils
-from . import apps
+import importlib
+import sys
+
+#
+# The order to resolve name conflicts (the later one wins), same as the star imports.
+_SUBMODULES = (
+    'settings',
+    'data',
+    'deprecated',
+    'initializers',
+    'operations',
+    'persistence',
+    'regularizers',
+    'training',
+    'widgets'
+)
+#
+# The order to search names, light modules first.
+_SEARCH_ORDER = (
+    'data',
+    'persistence',
+    'settings',
+    'initializers',
+    'operations',
+    'regularizers',
+    'widgets',
+    'training',
+    'deprecated'
+)
+_PACKAGES = ('utils', 'apps')
+
+_loaded = set()
+_owners = {}
+
+
+def _load_submodule(name):
+    module = importlib.import_module('.' + name, __name__)
+    _loaded.add(name)
+    rank = _SUBMODULES.index(name)
+    g = globals()
+    for key, value in vars(module).items():
+        if key.startswith('_'):
+            continue
+        if key in _owners and _owners[key] > rank:
+            continue
+        if key not in _owners and key in g:
+            #
+            # Names that defined in this file (and the submodules themselves).
+            continue
+        g[key] = value
+        _owners[key] = rank
+
+
+def _load_all():
+    for name in _SEARCH_ORDER:
+        if name not in _loaded:
+            _load_submodule(name)
+
+
+def __getattr__(name):
+    if name in _PACKAGES:
+        return importlib.import_module('.' + name, __name__)
+    if not name.startswith('_'):
+        for module_name in _SEARCH_ORDER:
+            if module_name in _loaded:
+                continue
+            _load_submodule(module_name)
+            if name in _owners:
+                return globals()[name]
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    _load_all()
+    return sorted(globals().keys())
+
+
+if sys.version_info < (3, 7):
+    #
+    # Module level __getattr__ is not supported (PEP 562), so import everything as before.
+    _load_all()
+    from . import utils
+    from . import apps
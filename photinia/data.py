@@ -11,7 +11,6 @@ import random
 import threading
 
 import numpy as np
-import pymongo
 
 
 class DataSource(object):
@@ -121,6 +120,7 @@ class MongoSource(DataSource):
         :param buffer_size: Positive integer. Default is 10000.
         """
         super(MongoSource, self).__init__()
+        import pymongo
         #
         # MongoDB Collection
         if isinstance(coll, pymongo.collection.Collection):
@@ -220,6 +220,7 @@ class MongoSource(DataSource):
 
     def _get_one_pass_buffer(self):
         if self._one_pass_buffer is None:
+            import pymongo
             batch = tuple([] for _ in self._fields)
             cur = self._coll.find(self._match, self._project, cursor_type=pymongo.CursorType.EXHAUST)
             for doc in cur:
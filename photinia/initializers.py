@@ -194,20 +194,16 @@ class Orthogonal(Initializer):
         for dim in shape[:-1]:
             num_rows *= dim
         num_cols = shape[-1]
-        flat_shape = (num_rows, num_cols)
-        if seed is not None:
-            np.random.seed(seed)
-        a = np.random.normal(0.0, 1.0, flat_shape)
-        u, _, v = np.linalg.svd(a, full_matrices=False)
-        # Pick the one with the correct shape.
-        q = u if u.shape == flat_shape else v
-        q = q.reshape(shape)
-        return tf.constant(
-            value=self._gain * q[:shape[0], :shape[1]],
-            dtype=settings.D_TYPE,
-            shape=shape,
-            name=name
-        )
+        #
+        # Generate the matrix in the graph, so the GraphDef size does not depend on the matrix size.
+        flat_shape = (max(num_rows, num_cols), min(num_rows, num_cols))
+        a = tf.random_normal(flat_shape, dtype=settings.D_TYPE, seed=seed)
+        q, r = tf.qr(a, full_matrices=False)
+        # Make Q uniform.
+        q *= tf.sign(tf.matrix_diag_part(r))
+        if num_rows < num_cols:
+            q = tf.transpose(q)
+        return tf.multiply(self._gain, tf.reshape(q, shape), name=name)
 
 
 class Identity(Initializer):
@@ -230,10 +226,9 @@ class Identity(Initializer):
             raise ValueError('Identity matrix initializer can only be used '
                              'for 2D square matrices.')
         else:
-            return tf.constant(
-                value=self._gain * np.identity(shape[0]),
-                dtype=settings.D_TYPE,
-                shape=shape,
+            return tf.multiply(
+                self._gain,
+                tf.eye(shape[0], dtype=settings.D_TYPE),
                 name=name
             )
 
@@ -5,6 +5,9 @@
 @since: 2017-03
 """
 
+import math
+import uuid
+
 import tensorflow as tf
 
 from . import settings
@@ -151,6 +154,87 @@ def setup(x,
     return y
 
 
+def recompute(fn,
+              inputs,
+              var_list=None,
+              name=None):
+    """Setup "fn" without keeping its intermediate activations for the backward pass.
+    The activations inside "fn" are recomputed from "inputs" when the gradients are computed,
+    which trades computation for memory (gradient checkpointing).
+    Note that random ops (e.g., dropout) inside "fn" are sampled again during the recomputation, and ops with side
+    effects (e.g., the moving average updates of batch normalization) run twice in a training step.
+
+    :param fn: A callable that maps the input tensors to ONE output tensor.
+    :param inputs: Tensor or list(tuple) of Tensors.
+    :param var_list: The variables used by "fn". Gradients are only propagated to these variables.
+    :param name: Operation name.
+    :return: The output tensor.
+    """
+    if not isinstance(inputs, (tuple, list)):
+        inputs = (inputs,)
+    inputs = [tf.convert_to_tensor(x) for x in inputs]
+    var_list = list(var_list) if var_list is not None else []
+
+    def _grad(_, *grads):
+        #
+        # The control dependency delays the recomputation until the backward pass reaches this point.
+        with tf.control_dependencies([grads[0]]):
+            new_inputs = [tf.identity(x) for x in inputs]
+        y_ = fn(*new_inputs)
+        grad_list = tf.gradients(y_, new_inputs + var_list, grad_ys=grads[0])
+        return [None] + grad_list
+
+    grad_name = 'Recompute_%s' % uuid.uuid4().hex
+    tf.RegisterGradient(grad_name)(_grad)
+    with tf.name_scope(name, 'recompute', inputs):
+        y = fn(*inputs)
+        with tf.get_default_graph().gradient_override_map({'IdentityN': grad_name}):
+            outputs = tf.identity_n([y] + inputs + var_list)
+    return outputs[0]
+
+
+def setup_checkpointed(x,
+                       widget_list,
+                       num_segments=None):
+    """Setup a series of widgets/ops like "setup", but with gradient checkpointing.
+    The list is split into segments, and only the segment boundaries are kept for the backward pass.
+    The activations inside each segment are recomputed by "recompute".
+    With the default ceil(sqrt(N)) segments, the activation memory is O(sqrt(N)) for N widgets/ops.
+    Each segment runs twice (see "recompute"), so keep the widgets with side effects (e.g., batch normalization that
+    updates its moving averages) out of "widget_list", or their updates are applied twice.
+    See "benchmarks/checkpointing.py" for the gradient and the peak memory comparison with "setup".
+
+    :param x: The input tensor.
+    :param widget_list: List of widgets/ops. (Same as "setup".)
+    :param num_segments: Number of segments. Default is ceil(sqrt(N)).
+    :return: The output form the last widget/op.
+    """
+    if widget_list is None:
+        return x
+    if not isinstance(widget_list, (list, tuple)):
+        widget_list = [widget_list]
+    widget_list = [w for w in widget_list if w is not None]
+    if len(widget_list) == 0:
+        return x
+    if num_segments is None:
+        num_segments = int(math.ceil(math.sqrt(len(widget_list))))
+    segment_size = int(math.ceil(len(widget_list) / num_segments))
+    y = x
+    for i in range(0, len(widget_list), segment_size):
+        segment = widget_list[i:i + segment_size]
+        var_list = [var for w in segment for var in _get_trainable_variables(w)]
+        y = recompute(lambda t, segment=segment: setup(t, segment), y, var_list)
+    return y
+
+
+def _get_trainable_variables(w):
+    if isinstance(w, (tuple, list)):
+        w = w[0]
+    if hasattr(w, 'get_trainable_variables'):
+        return w.get_trainable_variables()
+    return []
+
+
 def transpose_sequence(seq,
                        seq_axis=1,
                        name=None):
@@ -5,19 +5,80 @@
 @since: 2018-01-13
 """
 
+import concurrent.futures
+import hashlib
 import os
 import pickle
 import re
 import shutil
+import threading
+import zlib
 
-import gridfs
-import pymongo
+import numpy as np
 
 
 class ModelDumper(object):
     """ModelDumper
+
+    The tensors can be stored with lossy or compressed codecs (see "set_codec()"). They are encoded before dumping
+    and decoded (upcast to the original dtype) after loading.
     """
 
+    TMP_SUFFIX = '.tmp'
+    #
+    # The subclasses that do not call "ModelDumper.__init__()" have no codecs.
+    _codecs = ()
+
+    def __init__(self):
+        self._codecs = []
+
+    def set_codec(self, prefix, codec, tolerance=None):
+        """Set the storage codec of the parameters whose names start with the given prefix.
+        If more than one prefix match a parameter, the longest one is used.
+
+            dumper.set_codec('model/', BFloat16Codec(compression='zlib'))
+            dumper.set_codec('model/emb/', Int8Codec(), tolerance=0.01)
+
+        :param prefix: A string. Prefix of the parameter names. '' matches all the parameters.
+        :param codec: Codec. None means to store the matched parameters as they are.
+        :param tolerance: Max relative error, i.e., max(|decoded - value|) / max(|value|).
+            If the error of a tensor exceeds the tolerance, the tensor is stored as it is. None means no limit.
+        """
+        self._codecs = [item for item in self._codecs if item[0] != prefix]
+        self._codecs.append((prefix, codec, tolerance))
+        self._codecs.sort(key=lambda item: len(item[0]), reverse=True)
+
+    def _encode(self, param_dict):
+        if not self._codecs:
+            return param_dict
+        new_dict = {}
+        for key, value in param_dict.items():
+            for prefix, codec, tolerance in self._codecs:
+                if key.startswith(prefix):
+                    if codec is not None and codec.accept(value):
+                        value = codec.encode(value, tolerance)
+                    break
+            new_dict[key] = value
+        return new_dict
+
+    @staticmethod
+    def _decode(param_dict):
+        if param_dict is None:
+            return None
+        return {
+            key: Codec.decode(value) if Codec.is_encoded(value) else value
+            for key, value in param_dict.items()
+        }
+
+    def _write(self, param_dict, name):
+        self._dump(self._encode(param_dict), name)
+
+    def _read(self, name):
+        return self._decode(self._load(name))
+
+    def _read_path(self, name, path):
+        return self._decode(self._load_path(name, path))
+
     def dump(self, widget, name):
         """Dump the model to somewhere (file, DB, ...) using the given name.
 
@@ -25,11 +86,39 @@ class ModelDumper(object):
         :param name: The output name. (Not the model name. Note that the output is just one instance of the model.)
         """
         param_dict = widget.get_parameters()
-        self._dump(param_dict, name)
+        self._write(param_dict, name)
+
+    def dump_params(self, param_dict, name, atomic=True):
+        """Dump the parameters (e.g., a snapshot got by "widget.get_parameters()") using the given name.
+
+        :param param_dict: dict[str, np.ndarray]. Parameter name to value dictionary.
+        :param name: The output name.
+        :param atomic: If True, the parameters are dumped to a temporary name first, and then renamed to the given
+            name. So the output with the given name is either the old one or the complete new one.
+        """
+        if not atomic:
+            self._write(param_dict, name)
+            return
+        tmp_name = name + ModelDumper.TMP_SUFFIX
+        self._write(param_dict, tmp_name)
+        self._rename(tmp_name, name)
 
     def _dump(self, param_dict, name):
         raise NotImplementedError
 
+    def _rename(self, src, dst):
+        raise NotImplementedError
+
+    def delete(self, name):
+        """Delete the output with the given name.
+
+        :param name: The output name.
+        """
+        self._delete(name)
+
+    def _delete(self, name):
+        raise NotImplementedError
+
     # def load(self, name, model, alias_list=None):
     #     param_dict = self._load(name)
     #     if alias_list:
@@ -83,8 +172,10 @@ class ModelDumper(object):
         :param path: A string. The path would like to be loaded into the target widget.
         :param strict: Boolean. Strict mode.
         """
-        param_dict = self._load(name)
-        if path is not None:
+        if path is None:
+            param_dict = self._read(name)
+        else:
+            param_dict = self._read_path(name, path)
             new_dict = {}
             for key, value in param_dict.items():
                 if not key.startswith(path):
@@ -97,6 +188,206 @@ class ModelDumper(object):
     def _load(self, name):
         raise NotImplementedError
 
+    def _load_path(self, name, path):
+        """Load the parameters whose names start with the given path.
+        The default implementation loads all the parameters and then filters them.
+        The subclasses that can read the parameters separately should override this method.
+
+        :param name: A string. Model name.
+        :param path: A string. The path.
+        :return: dict[str, np.ndarray].
+        """
+        param_dict = self._load(name)
+        return {key: value for key, value in param_dict.items() if key.startswith(path)}
+
+    def initialize(self, name):
+        """Initialize all global variables from the given model (warm start).
+
+        The variables stored in the model are assigned with the stored values directly, without running their
+        initializers. Only the variables missing from the model are initialized by their initializers.
+        So this is a faster replacement of "initialize_global_variables()" followed by "load()".
+
+        :param name: A string. Model name.
+        """
+        from . import settings
+        param_dict = self._read(name)
+        settings.initialize_global_variables(param_dict)
+
+
+class Codec(object):
+    """Storage codec
+
+    A codec encodes a float tensor into a dict like:
+
+        {'__codec__': 'bfloat16', 'dtype': 'float32', 'shape': (100, 200), 'data': b'...', ...}
+
+    The data can be further compressed with "zlib" or "zstd" (requires the "zstandard" package).
+    """
+
+    NAME = None
+    CODECS = {}
+
+    def __init__(self, compression=None):
+        if compression not in (None, 'zlib', 'zstd'):
+            raise ValueError('compression should be one of None, "zlib" and "zstd".')
+        self._compression = compression
+
+    @property
+    def compression(self):
+        return self._compression
+
+    @staticmethod
+    def is_encoded(value):
+        return isinstance(value, dict) and '__codec__' in value
+
+    def accept(self, value):
+        return isinstance(value, np.ndarray) and value.dtype.kind == 'f'
+
+    def encode(self, value, tolerance=None):
+        """Encode a tensor.
+
+        :param value: np.ndarray.
+        :param tolerance: Max relative error. If it is exceeded, the value is returned as it is.
+        :return: The encoded dict, or the original value.
+        """
+        encoded = {
+            '__codec__': self.NAME,
+            'dtype': value.dtype.str,
+            'shape': value.shape,
+            'compression': self._compression
+        }
+        array = self._encode(value, encoded)
+        encoded['stored_dtype'] = array.dtype.str
+        if tolerance is not None:
+            error = np.max(np.abs(self._decode(array, encoded).astype(np.float64) - value)) if value.size else 0.0
+            scale = np.max(np.abs(value)) if value.size else 0.0
+            if error > tolerance * max(scale, np.finfo(np.float32).tiny):
+                return value
+        encoded['data'] = _compress(np.ascontiguousarray(array).tobytes(), self._compression)
+        return encoded
+
+    @staticmethod
+    def decode(encoded):
+        """Decode a tensor.
+
+        :param encoded: The encoded dict.
+        :return: np.ndarray with the original dtype.
+        """
+        codec_class = Codec.CODECS[encoded['__codec__']]
+        data = _decompress(encoded['data'], encoded['compression'])
+        array = np.frombuffer(data, dtype=np.dtype(encoded['stored_dtype'])).reshape(encoded['shape'])
+        return codec_class._decode(array, encoded).astype(np.dtype(encoded['dtype']))
+
+    def _encode(self, value, encoded):
+        raise NotImplementedError
+
+    @staticmethod
+    def _decode(array, encoded):
+        raise NotImplementedError
+
+
+def _compress(data, compression):
+    if compression is None:
+        return data
+    if compression == 'zlib':
+        return zlib.compress(data)
+    import zstandard
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _decompress(data, compression):
+    if compression is None:
+        return data
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    import zstandard
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _register_codec(codec_class):
+    Codec.CODECS[codec_class.NAME] = codec_class
+    return codec_class
+
+
+@_register_codec
+class RawCodec(Codec):
+    """Store the tensors as they are (only compressed).
+    """
+
+    NAME = 'raw'
+
+    def accept(self, value):
+        return isinstance(value, np.ndarray) and value.dtype.kind in 'fiub'
+
+    def _encode(self, value, encoded):
+        return value
+
+    @staticmethod
+    def _decode(array, encoded):
+        return array
+
+
+@_register_codec
+class Float16Codec(Codec):
+    """Store the tensors as float16.
+    """
+
+    NAME = 'float16'
+
+    def _encode(self, value, encoded):
+        return value.astype(np.float16)
+
+    @staticmethod
+    def _decode(array, encoded):
+        return array
+
+
+@_register_codec
+class BFloat16Codec(Codec):
+    """Store the tensors as bfloat16 (the higher 16 bits of float32, rounded to nearest even).
+    It has the same range as float32, so it does not overflow like float16.
+    """
+
+    NAME = 'bfloat16'
+
+    def _encode(self, value, encoded):
+        bits = np.ascontiguousarray(value, dtype=np.float32).view(np.uint32)
+        rounding = np.uint32(0x7fff) + ((bits >> np.uint32(16)) & np.uint32(1))
+        high = ((bits + rounding) >> np.uint32(16)).astype(np.uint16)
+        #
+        # Keep NaN as NaN (the rounding may carry it into infinity).
+        nan = np.isnan(value)
+        if np.any(nan):
+            high[nan] = ((bits[nan] >> np.uint32(16)) | np.uint32(0x40)).astype(np.uint16)
+        return high
+
+    @staticmethod
+    def _decode(array, encoded):
+        return (array.astype(np.uint32) << np.uint32(16)).view(np.float32)
+
+
+@_register_codec
+class Int8Codec(Codec):
+    """Store the tensors as int8, with one float32 scale for each channel (the last axis).
+    The tensors with less than 2 dimensions use one scale.
+    """
+
+    NAME = 'int8'
+
+    def _encode(self, value, encoded):
+        value = value.astype(np.float32)
+        if value.ndim < 2:
+            max_abs = np.max(np.abs(value), keepdims=True) if value.size else np.zeros((1,), np.float32)
+        else:
+            max_abs = np.max(np.abs(value), axis=tuple(range(value.ndim - 1)))
+        scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        encoded['scales'] = scales
+        return np.clip(np.round(value / scales), -127, 127).astype(np.int8)
+
+    @staticmethod
+    def _decode(array, encoded):
+        return array.astype(np.float32) * encoded['scales']
+
 
 class FileDumper(ModelDumper):
     """File Dumper
@@ -123,6 +414,14 @@ class FileDumper(ModelDumper):
         with open(model_file, 'wb') as f:
             pickle.dump(param_dict, f)
 
+    def _rename(self, src, dst):
+        os.replace(os.path.join(self._output_dir, src), os.path.join(self._output_dir, dst))
+
+    def _delete(self, name):
+        model_file = os.path.join(self._output_dir, name)
+        if os.path.exists(model_file):
+            os.remove(model_file)
+
     def _load(self, name):
         param_file = os.path.join(self._output_dir, name)
         with open(param_file, 'rb') as f:
@@ -156,24 +455,74 @@ class TreeDumper(ModelDumper):
     def default_load(widget, name, path=None, strict=True):
         TreeDumper.get_instance().load(widget, name, path, strict)
 
-    def __init__(self, output_dir=None):
+    def __init__(self, output_dir=None, num_workers=8):
+        """Create a tree dumper.
+
+        :param output_dir: The output directory. None means the names are used as the model directories directly.
+        :param num_workers: Number of threads to write and read the parameter files.
+            On network filesystems, the latency of opening a file dominates, so the files are processed in parallel.
+            1 means to process the files serially.
+        """
         super(TreeDumper, self).__init__()
+        if num_workers < 1:
+            raise ValueError('num_workers should be a positive integer.')
         self._output_dir = output_dir
+        self._num_workers = num_workers
+
+    @property
+    def num_workers(self):
+        return self._num_workers
+
+    def _model_dir(self, name):
+        return name if self._output_dir is None else os.path.join(self._output_dir, name)
 
     def _dump(self, param_dict, name):
-        model_dir = name if self._output_dir is None else os.path.join(self._output_dir, name)
+        model_dir = self._model_dir(name)
         if os.path.exists(model_dir):
             shutil.rmtree(model_dir)
         os.mkdir(model_dir)
-        for path, value in param_dict.items():
-            param_dir, _ = os.path.split(path)
-            param_dir = os.path.join(model_dir, param_dir)
-            param_file = os.path.join(model_dir, path)
-            param_file = TreeDumper._escape(param_file)
-            if not os.path.exists(param_dir):
-                os.makedirs(param_dir)
-            with open(param_file, 'wb') as f:
-                pickle.dump(value, f)
+        param_dirs = {os.path.join(model_dir, os.path.dirname(path)) for path in param_dict}
+        for param_dir in sorted(param_dirs):
+            os.makedirs(param_dir, exist_ok=True)
+        self._map(
+            TreeDumper._write_file,
+            [(TreeDumper._escape(os.path.join(model_dir, path)), value) for path, value in param_dict.items()]
+        )
+
+    @staticmethod
+    def _write_file(args):
+        param_file, value = args
+        with open(param_file, 'wb') as f:
+            pickle.dump(value, f)
+
+    def _map(self, fn, args_list):
+        if self._num_workers == 1 or len(args_list) <= 1:
+            return [fn(args) for args in args_list]
+        with concurrent.futures.ThreadPoolExecutor(min(self._num_workers, len(args_list))) as executor:
+            return list(executor.map(fn, args_list))
+
+    def _rename(self, src, dst):
+        src_dir = self._model_dir(src)
+        dst_dir = self._model_dir(dst)
+        old_dir = dst_dir + '.old'
+        if not os.path.exists(dst_dir):
+            os.rename(src_dir, dst_dir)
+        else:
+            #
+            # A non-empty directory cannot be replaced by rename, so move the old one away first.
+            # If the process stops between the two renames, "_load()" falls back to the ".old" directory.
+            if os.path.exists(old_dir):
+                shutil.rmtree(old_dir)
+            os.rename(dst_dir, old_dir)
+            os.rename(src_dir, dst_dir)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+
+    def _delete(self, name):
+        model_dir = self._model_dir(name)
+        for path in (model_dir, model_dir + '.old'):
+            if os.path.exists(path):
+                shutil.rmtree(path)
 
     @staticmethod
     def _escape(path):
@@ -187,26 +536,30 @@ class TreeDumper(ModelDumper):
         return ''.join(path)
 
     def _load(self, name):
-        model_dir = name if self._output_dir is None else os.path.join(self._output_dir, name)
+        model_dir = self._model_dir(name)
+        if not os.path.exists(model_dir) and os.path.exists(model_dir + '.old'):
+            #
+            # An atomic dump was interrupted while the old model was moved away.
+            model_dir = model_dir + '.old'
         if not os.path.exists(model_dir):
             raise FileNotFoundError()
-        param_dict = {}
-        for path in os.listdir(model_dir):
-            TreeDumper._load_tree(model_dir, path, param_dict)
-        return param_dict
+        path_list = []
+        for dir_path, _, file_names in os.walk(model_dir):
+            for file_name in file_names:
+                path_list.append(os.path.relpath(os.path.join(dir_path, file_name), model_dir))
+        value_list = self._map(
+            TreeDumper._read_file,
+            [os.path.join(model_dir, path) for path in path_list]
+        )
+        return {
+            TreeDumper._unescape(path): value
+            for path, value in zip(path_list, value_list)
+        }
 
     @staticmethod
-    def _load_tree(model_dir, path, param_dict):
-        real_path = os.path.join(model_dir, path)
-        if os.path.isdir(real_path):
-            for subpath in os.listdir(real_path):
-                subpath = os.path.join(path, subpath)
-                TreeDumper._load_tree(model_dir, subpath, param_dict)
-        elif os.path.isfile(real_path):
-            path = TreeDumper._unescape(path)
-            with open(real_path, 'rb') as f:
-                value = pickle.load(f)
-                param_dict[path] = value
+    def _read_file(param_file):
+        with open(param_file, 'rb') as f:
+            return pickle.load(f)
 
     @staticmethod
     def _unescape(path):
@@ -220,40 +573,339 @@ class TreeDumper(ModelDumper):
         return ''.join(path)
 
 
+class DeltaDumper(ModelDumper):
+    """Delta Dumper
+
+    Wrap another dumper to write incremental checkpoints.
+    Each tensor is hashed, and only the tensors that differ from the base checkpoint are written, together with a
+    manifest which records the base name and the hashes of the full state.
+    When loading, the missing tensors are resolved from the base checkpoint (and its base, ...).
+    So in fine-tuning, where most of the layers are frozen, the storage and the write time scale with the trained part
+    of the model.
+
+        dumper = DeltaDumper(FileDumper('models'), base='pretrained')
+        dumper.dump(model, 'finetuned-1')
+
+    Note that a checkpoint can only be loaded while all the checkpoints it depends on exist.
+    When a checkpoint is deleted with this dumper (e.g., the rotation of CheckpointFitter), the tensors that the deltas
+    dumped by it still need are folded into those deltas first, so they remain loadable.
+    """
+
+    MANIFEST_KEY = '__manifest__'
+
+    def __init__(self, dumper, base=None, chain=False):
+        """Create a delta dumper.
+
+        :param dumper: The ModelDumper to write the checkpoints.
+        :param base: Name of the base checkpoint. None means to write full checkpoints until a base is set.
+        :param chain: If True, each dumped checkpoint becomes the base of the next one. This saves the most storage,
+            but the checkpoints in the chain must only be deleted with this dumper. If False, all the deltas are
+            computed against the same base, and each one only depends on the base.
+        """
+        super(DeltaDumper, self).__init__()
+        self._dumper = dumper
+        self._chain = chain
+        self._base = None
+        self._base_hashes = None
+        self.base = base
+        #
+        # Base name to the names of the deltas dumped against it.
+        self._children = {}
+
+    @property
+    def dumper(self):
+        return self._dumper
+
+    def set_codec(self, prefix, codec, tolerance=None):
+        """The codecs are applied by the underlying dumper, so that the tensors are hashed before encoding.
+        """
+        self._dumper.set_codec(prefix, codec, tolerance)
+
+    @property
+    def base(self):
+        return self._base
+
+    @base.setter
+    def base(self, base):
+        self._base = base
+        self._base_hashes = None
+
+    def _dump(self, param_dict, name):
+        final_name = DeltaDumper._final_name(name)
+        for child in self._children.pop(final_name, ()):
+            #
+            # The checkpoint is going to be replaced, so the deltas depending on it must not see the new tensors.
+            self._fold(final_name, child)
+        hashes = {key: DeltaDumper._hash(value) for key, value in param_dict.items()}
+        if self._base is None or self._base == final_name:
+            #
+            # A delta must not replace its own base (e.g., an atomic dump to the base name), so write a full one.
+            delta_dict = dict(param_dict)
+            base = None
+            if self._base is not None:
+                self._base_hashes = None
+        else:
+            if self._base_hashes is None:
+                self._base_hashes = self._load_hashes(self._base)
+            base_hashes = self._base_hashes
+            delta_dict = {
+                key: value
+                for key, value in param_dict.items()
+                if base_hashes.get(key) != hashes[key]
+            }
+            base = self._base
+        delta_dict[DeltaDumper.MANIFEST_KEY] = {'base': base, 'hashes': hashes}
+        self._dumper._write(delta_dict, name)
+        if base is not None:
+            self._children.setdefault(base, set()).add(name)
+        if self._chain:
+            self._base = name
+            self._base_hashes = hashes
+
+    def _rename(self, src, dst):
+        self._dumper._rename(src, dst)
+        if self._base == src:
+            self._base = dst
+        for children in self._children.values():
+            if src in children:
+                children.remove(src)
+                children.add(dst)
+        if src in self._children:
+            self._children[dst] = self._children.pop(src)
+
+    def _delete(self, name):
+        for child in self._children.pop(name, ()):
+            self._fold(name, child)
+        for children in self._children.values():
+            children.discard(name)
+        self._dumper._delete(name)
+        if self._base == name:
+            self.base = None
+
+    def _fold(self, parent, child):
+        """Copy the tensors that the child takes from the parent into the child, and rebase the child to the parent's
+        base.
+        """
+        parent_dict = self._dumper._read(parent)
+        parent_manifest = parent_dict.pop(DeltaDumper.MANIFEST_KEY, None)
+        child_dict = self._dumper._read(child)
+        hashes = child_dict[DeltaDumper.MANIFEST_KEY]['hashes']
+        for key, value in parent_dict.items():
+            if key in hashes and key not in child_dict:
+                child_dict[key] = value
+        base = parent_manifest['base'] if parent_manifest is not None else None
+        child_dict[DeltaDumper.MANIFEST_KEY] = {'base': base, 'hashes': hashes}
+        tmp_name = child + ModelDumper.TMP_SUFFIX
+        self._dumper._write(child_dict, tmp_name)
+        self._dumper._rename(tmp_name, child)
+        if base is not None:
+            self._children.setdefault(base, set()).add(child)
+
+    def _load(self, name):
+        delta_dict = self._dumper._read(name)
+        manifest = delta_dict.pop(DeltaDumper.MANIFEST_KEY, None)
+        if manifest is None:
+            #
+            # A full checkpoint not written by DeltaDumper.
+            return delta_dict
+        hashes = manifest['hashes']
+        param_dict = {key: value for key, value in delta_dict.items() if key in hashes}
+        base = manifest['base']
+        visited = {name}
+        while base is not None and len(param_dict) < len(hashes):
+            if base in visited:
+                raise RuntimeError('Cyclic base checkpoints: %s depends on itself.' % base)
+            visited.add(base)
+            delta_dict = self._dumper._read(base)
+            manifest = delta_dict.pop(DeltaDumper.MANIFEST_KEY, None)
+            for key, value in delta_dict.items():
+                if key in hashes and key not in param_dict:
+                    param_dict[key] = value
+            base = manifest['base'] if manifest is not None else None
+        if len(param_dict) < len(hashes):
+            missing = [key for key in hashes if key not in param_dict]
+            raise RuntimeError('Failed to resolve %s from the base checkpoints of %s.' % (missing, name))
+        return param_dict
+
+    @staticmethod
+    def _final_name(name):
+        if name.endswith(ModelDumper.TMP_SUFFIX):
+            return name[:-len(ModelDumper.TMP_SUFFIX)]
+        return name
+
+    def _load_hashes(self, name):
+        delta_dict = self._dumper._read(name)
+        manifest = delta_dict.get(DeltaDumper.MANIFEST_KEY)
+        if manifest is not None:
+            return manifest['hashes']
+        return {key: DeltaDumper._hash(value) for key, value in delta_dict.items()}
+
+    @staticmethod
+    def _hash(value):
+        """Hash a tensor, including its dtype and shape.
+
+        :param value: np.ndarray.
+        :return: Hex digest string.
+        """
+        h = hashlib.sha1()
+        h.update(str(value.dtype).encode())
+        h.update(str(value.shape).encode())
+        h.update(value.tobytes() if not value.flags.c_contiguous else value.data)
+        return h.hexdigest()
+
+
 class MongoDumper(ModelDumper):
     """MongoDB Model Dumper
+
+    Each tensor is stored as one GridFS file, and a manifest document in the "{coll}.manifests" collection maps the
+    parameter names to the files. So a partial load (with "path") only downloads the matching tensors.
+    The manifest is written after all the tensors, so a model becomes visible only when it is completely written.
+    The models dumped as one pickled GridFS file by the old versions can still be loaded.
+
+    The client is created on the first use and shared by all the operations (it maintains a connection pool).
+    Call "close()" to release it.
     """
 
-    def __init__(self, host, db_name, coll='models'):
+    def __init__(self, host, db_name, coll='models', client=None, num_workers=8):
+        """Create a MongoDB dumper.
+
+        :param host: MongoDB URI or host name.
+        :param db_name: Database name.
+        :param coll: Collection name of the GridFS files.
+        :param client: An existing client to use (e.g., mongomock.MongoClient()). Default is to create one.
+        :param num_workers: Number of threads to write and read the tensors.
+        """
+        if num_workers < 1:
+            raise ValueError('num_workers should be a positive integer.')
         self._host = host
         self._db_name = db_name
         self._coll = coll
+        self._client = client
+        self._own_client = client is None
+        self._num_workers = num_workers
+        self._lock = threading.Lock()
         super(MongoDumper, self).__init__()
 
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import pymongo
+                self._client = pymongo.MongoClient(self._host)
+            return self._client
+
+    def close(self):
+        """Close the client (only if it is created by this dumper).
+        """
+        with self._lock:
+            if self._client is not None and self._own_client:
+                self._client.close()
+                self._client = None
+
+    def _get_db(self):
+        return self.client[self._db_name]
+
+    def _get_fs(self):
+        import gridfs
+        return gridfs.GridFS(self._get_db(), collection=self._coll)
+
+    def _get_manifests(self):
+        return self._get_db()[self._coll + '.manifests']
+
+    def _map(self, fn, args_list):
+        if self._num_workers == 1 or len(args_list) <= 1:
+            return [fn(args) for args in args_list]
+        with concurrent.futures.ThreadPoolExecutor(min(self._num_workers, len(args_list))) as executor:
+            return list(executor.map(fn, args_list))
+
     def clear(self):
-        with pymongo.MongoClient(self._host) as conn:
-            db = conn[self._db_name]
-            coll1 = db[self._coll + '.files']
-            coll2 = db[self._coll + '.chunks']
-            coll1.remove()
-            coll2.remove()
-
-    def _dump(self, param_dict, name, **kwargs):
-        with pymongo.MongoClient(self._host) as conn:
-            db = conn[self._db_name]
-            fs = gridfs.GridFS(db, collection=self._coll)
-            if fs.exists(name):
-                fs.delete(name)
-            with fs.new_file(_id=name, **kwargs) as f:
-                pickle.dump(param_dict, f)
+        db = self._get_db()
+        db[self._coll + '.files'].delete_many({})
+        db[self._coll + '.chunks'].delete_many({})
+        db[self._coll + '.manifests'].delete_many({})
+
+    def _dump(self, param_dict, name):
+        fs = self._get_fs()
+
+        def _put(item):
+            key, value = item
+            return fs.put(pickle.dumps(value), filename=name, param=key)
+
+        items = list(param_dict.items())
+        file_ids = self._map(_put, items)
+        tensors = {key: file_id for (key, _), file_id in zip(items, file_ids)}
+        self._replace_manifest(name, tensors)
+
+    def _replace_manifest(self, name, tensors):
+        old = self._get_manifests().find_one_and_replace(
+            {'_id': name},
+            {'_id': name, 'tensors': _encode_tensors(tensors)},
+            upsert=True
+        )
+        self._delete_files(old)
+
+    def _delete_files(self, manifest, name=None):
+        fs = self._get_fs()
+        if manifest is not None:
+            for file_id in _decode_tensors(manifest['tensors']).values():
+                fs.delete(file_id)
+        if name is not None and fs.exists(name):
+            #
+            # The single file model dumped by the old versions.
+            fs.delete(name)
+
+    def _rename(self, src, dst):
+        manifests = self._get_manifests()
+        manifest = manifests.find_one({'_id': src})
+        if manifest is None:
+            raise FileNotFoundError('Model %s does not exist.' % src)
+        self._replace_manifest(dst, _decode_tensors(manifest['tensors']))
+        manifests.delete_one({'_id': src})
+        self._delete_files(None, dst)
+
+    def _delete(self, name):
+        manifest = self._get_manifests().find_one_and_delete({'_id': name})
+        self._delete_files(manifest, name)
 
     def _load(self, name):
-        with pymongo.MongoClient(self._host) as conn:
-            db = conn[self._db_name]
-            fs = gridfs.GridFS(db, collection=self._coll)
+        return self._load_tensors(name, None)
+
+    def _load_path(self, name, path):
+        return self._load_tensors(name, path)
+
+    def _load_tensors(self, name, path):
+        fs = self._get_fs()
+        manifest = self._get_manifests().find_one({'_id': name})
+        if manifest is None:
             f = fs.find_one({'_id': name})
             if f is None:
                 return None
             with f:
                 param_dict = pickle.load(f)
-        return param_dict
+            if path is not None:
+                param_dict = {key: value for key, value in param_dict.items() if key.startswith(path)}
+            return param_dict
+        tensors = _decode_tensors(manifest['tensors'])
+        items = [
+            (key, file_id)
+            for key, file_id in tensors.items()
+            if path is None or key.startswith(path)
+        ]
+
+        def _get(item):
+            with fs.get(item[1]) as f:
+                return pickle.load(f)
+
+        value_list = self._map(_get, items)
+        return {key: value for (key, _), value in zip(items, value_list)}
+
+
+def _encode_tensors(tensors):
+    """The parameter names may contain ".", which is not allowed in MongoDB field names.
+    So the name to file id dictionary is stored as a list.
+    """
+    return [{'name': key, 'file_id': file_id} for key, file_id in tensors.items()]
+
+
+def _decode_tensors(tensors):
+    return {item['name']: item['file_id'] for item in tensors}
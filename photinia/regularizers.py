@@ -16,18 +16,19 @@ class Regularizer(object):
         self._items = collections.defaultdict(list)
 
     def add(self, tensors, reg_op, weight=None):
+        """Add regularization items.
+        The items are only recorded here. The graph is built in "get_loss", where tensors sharing the same
+        reg_op and weight are summed together with one tf.add_n.
+
+        :param tensors: Tensor or list(tuple) of Tensors.
+        :param reg_op: Regularization operation, e.g., l1_norm, l2_norm.
+        :param weight: Weight of the items.
+        :return: The regularizer itself.
+        """
         if not isinstance(tensors, (list, tuple)):
-            tensor = tensors
-            item = reg_op(tensor)
-            if weight is not None:
-                item *= weight
-            self._items[tensor].append(item)
-        else:
-            for tensor in tensors:
-                item = reg_op(tensor)
-                if weight is not None:
-                    item *= weight
-                self._items[tensor].append(item)
+            tensors = (tensors,)
+        for tensor in tensors:
+            self._items[tensor].append((reg_op, weight))
         return self
 
     def add_l1(self, tensors, weight=None):
@@ -57,16 +58,22 @@ class Regularizer(object):
         return self
 
     def get_loss(self, weight=1e-5):
-        items = [
-            item
-            for partial_items in self._items.values()
-            for item in partial_items
-        ]
-        if len(items) == 0:
+        groups = collections.OrderedDict()
+        for tensor, partial_items in self._items.items():
+            for reg_op, item_weight in partial_items:
+                key = (reg_op, item_weight)
+                if key not in groups:
+                    groups[key] = []
+                groups[key].append(tensor)
+        if len(groups) == 0:
             return 0
-        loss = items[0]
-        for item in items[1:]:
-            loss += item
+        loss_list = []
+        for (reg_op, item_weight), tensors in groups.items():
+            loss = tf.add_n([reg_op(tensor) for tensor in tensors])
+            if item_weight is not None:
+                loss *= item_weight
+            loss_list.append(loss)
+        loss = tf.add_n(loss_list)
         loss *= weight
         return loss
 
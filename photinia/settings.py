@@ -5,6 +5,8 @@
 @since: 2017-12-12
 """
 
+import os
+
 import tensorflow as tf
 
 D_TYPE = tf.float32
@@ -12,10 +14,16 @@ D_TYPE = tf.float32
 TRAIN = 'train'
 VALIDATE = 'validate'
 PREDICT = 'predict'
+APPLY = 'apply'
 
 CONTEXT_TRAINER = 'trainer'
 CONTEXT_LOOP = 'loop'
 CONTEXT_MAX_LOOP = 'max_loop'
+CONTEXT_TIMER = 'timer'
+
+ENV_INTRA_OP_THREADS = 'PHOTINIA_INTRA_OP_THREADS'
+ENV_INTER_OP_THREADS = 'PHOTINIA_INTER_OP_THREADS'
+ENV_CPU_AFFINITY = 'PHOTINIA_CPU_AFFINITY'
 
 
 class __GlobalContext(object):
@@ -24,6 +32,16 @@ class __GlobalContext(object):
         self._session_config = tf.ConfigProto()
         self._session_config.gpu_options.allow_growth = True
         self._session = None
+        #
+        # Thread and CPU configuration from the environment.
+        # E.g., PHOTINIA_INTRA_OP_THREADS=8 PHOTINIA_INTER_OP_THREADS=2 PHOTINIA_CPU_AFFINITY=0-7
+        self._cpu_affinity = None
+        if ENV_INTRA_OP_THREADS in os.environ:
+            self._session_config.intra_op_parallelism_threads = int(os.environ[ENV_INTRA_OP_THREADS])
+        if ENV_INTER_OP_THREADS in os.environ:
+            self._session_config.inter_op_parallelism_threads = int(os.environ[ENV_INTER_OP_THREADS])
+        if ENV_CPU_AFFINITY in os.environ:
+            self._cpu_affinity = _parse_cpu_list(os.environ[ENV_CPU_AFFINITY])
 
     # def __del__(self):
     #     if self._session is not None:
@@ -36,20 +54,249 @@ class __GlobalContext(object):
     @property
     def session(self):
         if self._session is None:
+            self.apply_cpu_affinity()
             self._session = tf.Session(config=self._session_config)
         return self._session
 
+    def apply_cpu_affinity(self):
+        """Apply the CPU affinity (if it is configured) before a session is created.
+        """
+        if self._cpu_affinity is not None:
+            _set_affinity(self._cpu_affinity)
+
+    @property
+    def session_created(self):
+        return self._session is not None
+
+    def set_num_threads(self, intra_op=None, inter_op=None):
+        if intra_op is not None:
+            self._session_config.intra_op_parallelism_threads = intra_op
+        if inter_op is not None:
+            self._session_config.inter_op_parallelism_threads = inter_op
+
+    def set_cpu_affinity(self, cpus):
+        if isinstance(cpus, str):
+            cpus = _parse_cpu_list(cpus)
+        cpus = sorted(set(cpus))
+        _set_affinity(cpus)
+        self._cpu_affinity = cpus
+
+
+def _parse_cpu_list(cpu_list):
+    """Parse a CPU list string like "0-3,8,10-11".
+
+    :param cpu_list: The CPU list string.
+    :return: List of CPU ids.
+    """
+    cpus = []
+    for item in cpu_list.split(','):
+        item = item.strip()
+        if item == '':
+            continue
+        if '-' in item:
+            start, end = item.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(item))
+    return cpus
+
+
+def _set_affinity(cpus):
+    if not hasattr(os, 'sched_setaffinity'):
+        raise RuntimeError('Setting CPU affinity is not supported on this platform.')
+    os.sched_setaffinity(0, cpus)
+
+
+def _available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
 
 __GLOBAL = __GlobalContext()
 
+#
+# Graph to SessionScope dictionary.
+__SCOPES = {}
+
+
+class SessionScope(object):
+    """Session scope.
+
+    A session scope carries its own graph and session, so that several models can be built and run independently
+    in one process. Inside the "with" block, the scope's graph is the default graph, and all photinia entry points
+    (Slot, Widget.get_parameters, the dumpers, ...) resolve the session from the graph they work on:
+
+        with ph.SessionScope() as scope:
+            model = MyModel('model')
+            ph.initialize_global_variables()
+        ...
+        with scope:
+            model.predict(batch)
+
+    Widgets and Slots built inside the scope keep using the scope's session even outside the "with" block.
+    The thread and CPU affinity settings (see "set_num_threads()" and "set_cpu_affinity()") apply to the scope's
+    session too, as long as they are set before the session is created.
+    """
+
+    def __init__(self, graph=None, config=None):
+        """Create a session scope.
+
+        :param graph: tf.Graph. Default is a new graph.
+        :param config: tf.ConfigProto. Default is the global session config (read when the session is created).
+        """
+        self._graph = graph if graph is not None else tf.Graph()
+        self._config = config
+        self._session = None
+        self._context_stack = []
+        _register_scope(self)
+
+    @property
+    def graph(self):
+        return self._graph
+
+    @property
+    def config(self):
+        return self._config if self._config is not None else get_session_config()
+
+    @property
+    def session(self):
+        if self._session is None:
+            _apply_cpu_affinity()
+            self._session = tf.Session(graph=self._graph, config=self.config)
+        return self._session
+
+    @property
+    def session_created(self):
+        return self._session is not None
+
+    def close(self):
+        """Close the session and unregister the scope.
+        The widgets built in the scope's graph are dropped from the widget registry, so that the graph and the widgets
+        can be released.
+        """
+        from . import widgets
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        _unregister_scope(self)
+        with widgets.Widget.LOCK:
+            widgets.Widget.INSTANCES.pop(self._graph, None)
+
+    def __enter__(self):
+        context = self._graph.as_default()
+        context.__enter__()
+        self._context_stack.append(context)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        context = self._context_stack.pop()
+        context.__exit__(exc_type, exc_val, exc_tb)
+
+
+def _register_scope(scope):
+    if scope.graph in __SCOPES:
+        raise ValueError('The graph already has a session scope.')
+    __SCOPES[scope.graph] = scope
+
+
+def _unregister_scope(scope):
+    if __SCOPES.get(scope.graph) is scope:
+        del __SCOPES[scope.graph]
+
 
 def get_session_config():
     return __GLOBAL.session_config
 
 
-def get_session():
+def _apply_cpu_affinity():
+    __GLOBAL.apply_cpu_affinity()
+
+
+def _check_session_not_created():
+    if __GLOBAL.session_created or any(scope.session_created for scope in __SCOPES.values()):
+        raise RuntimeError('The session has been created. '
+                           'Threads and CPU affinity should be configured before the session is created.')
+
+
+def get_session(graph=None):
+    """Get the session to run the given graph.
+
+    :param graph: tf.Graph. Default is the current default graph.
+    :return: The session of the SessionScope that owns the graph, or the global session if there is no such scope.
+    """
+    if graph is None:
+        graph = tf.get_default_graph()
+    scope = __SCOPES.get(graph)
+    if scope is not None:
+        return scope.session
     return __GLOBAL.session
 
 
-def initialize_global_variables():
-    __GLOBAL.session.run(tf.global_variables_initializer())
+def set_num_threads(intra_op=None, inter_op=None):
+    """Set the sizes of the thread pools used by the session.
+    Must be called before the session is created.
+
+    :param intra_op: Number of threads used to run a single op (e.g., a large matmul). 0 means TF's default.
+    :param inter_op: Number of threads used to run independent ops in parallel. 0 means TF's default.
+    """
+    _check_session_not_created()
+    __GLOBAL.set_num_threads(intra_op, inter_op)
+
+
+def set_cpu_affinity(cpus):
+    """Pin the current process (and so the session's threads) to the given CPUs.
+    Must be called before the session is created.
+
+    :param cpus: List of CPU ids, or a CPU list string like "0-3,8,10-11".
+    """
+    _check_session_not_created()
+    __GLOBAL.set_cpu_affinity(cpus)
+
+
+def partition_cpus(num_processes, rank, inter_op=1):
+    """Split the available CPUs evenly among several trainer processes running on the same server.
+    The process with the given rank is pinned to its own share of CPUs, and the intra op threads are set to the
+    number of CPUs in the share, so that the processes do not oversubscribe the cores.
+    Must be called before the session is created.
+
+    :param num_processes: Number of co-located trainer processes.
+    :param rank: Rank of the current process, in range [0, num_processes).
+    :param inter_op: Number of inter op threads. Default is 1.
+    :return: List of CPU ids assigned to the current process.
+    """
+    if not 0 <= rank < num_processes:
+        raise ValueError('rank should be in range [0, num_processes).')
+    cpus = _available_cpus()
+    if len(cpus) < num_processes:
+        raise ValueError('Only %d CPUs are available for %d processes.' % (len(cpus), num_processes))
+    start = rank * len(cpus) // num_processes
+    end = (rank + 1) * len(cpus) // num_processes
+    cpus = cpus[start:end]
+    set_cpu_affinity(cpus)
+    set_num_threads(len(cpus), inter_op)
+    return cpus
+
+
+def initialize_global_variables(param_dict=None):
+    """Initialize all global variables.
+
+    If param_dict is given (e.g., loaded from a checkpoint), the variables found in it are assigned with the stored
+    values directly, and their initializers (which may be expensive, e.g., Orthogonal) are never computed.
+    Only the variables missing from param_dict are initialized by their initializers.
+
+    :param param_dict: dict[str, np.ndarray]. Variable name to value dictionary.
+    """
+    session = get_session()
+    if param_dict is None:
+        session.run(tf.global_variables_initializer())
+        return
+    var_list = tf.global_variables()
+    #
+    # Feeding the initial value tensor of a variable skips the computation of its initializer.
+    feed_dict = {
+        var.initializer.inputs[1]: param_dict[var.name]
+        for var in var_list
+        if var.name in param_dict
+    }
+    session.run([var.initializer for var in var_list], feed_dict=feed_dict)
@@ -8,8 +8,11 @@
 import collections
 import datetime as dt
 import os
+import threading
+import time
 
 import numpy as np
+import tensorflow as tf
 
 from . import settings
 from . import data
@@ -25,13 +28,15 @@ class Slot(object):
                  outputs=None,
                  updates=None,
                  givens=None,
-                 callbacks=None):
+                 callbacks=None,
+                 tracer=None):
         """Create a Slot with the given params.
 
         :param inputs: Tensor or list(tuple) of Tensors.
         :param outputs: Tensor, list(tuple) of Tensors or Tensor dict.
         :param updates: Operator or list(tuple) of Operators.
         :param givens: Tensor dict.
+        :param tracer: TimelineTracer. Capture the run metadata of some of the calls.
         """
         # if session is None:
         #     raise ValueError('Invalid session.')
@@ -73,6 +78,7 @@ class Slot(object):
         if not isinstance(callbacks, (tuple, list)):
             callbacks = (callbacks,)
         self._callbacks = callbacks
+        self._tracer = tracer
         #
         self._feed_dict = givens.copy()
         self._fetches = (outputs, updates)
@@ -95,6 +101,14 @@ class Slot(object):
     def givens(self):
         return self._givens
 
+    @property
+    def tracer(self):
+        return self._tracer
+
+    @tracer.setter
+    def tracer(self, tracer):
+        self._tracer = tracer
+
     def __call__(self, *args):
         #
         # Check input length.
@@ -107,12 +121,148 @@ class Slot(object):
             self._feed_dict[placeholder] = args[index]
         #
         # Run the graph on the session.
-        ret = self._session.run(fetches=self._fetches, feed_dict=self._feed_dict)[0]
+        if self._tracer is not None and self._tracer.step():
+            ret = self._tracer.run(self._session, self._fetches, self._feed_dict)[0]
+        else:
+            ret = self._session.run(fetches=self._fetches, feed_dict=self._feed_dict)[0]
         for callback in self._callbacks:
             callback(ret)
         return ret
 
 
+class TimelineTracer(object):
+    """Timeline tracer
+
+    Run every Nth call of a Slot with full trace, and write two files for each traced call:
+
+        "{output_dir}/{name}-{step}.json": The Chrome trace of the run, which can be opened with "chrome://tracing".
+        "{output_dir}/{name}-{step}.txt": Summary tables of the top ops and widgets by time and by allocated bytes.
+
+    The ops are aggregated per widget by matching the op names with the widgets' full names.
+    The backward ops (under "gradients/") are counted to the widgets of their forward ops.
+    """
+
+    def __init__(self,
+                 output_dir,
+                 interval=100,
+                 name='timeline',
+                 top_k=20,
+                 show_memory=True):
+        """Create a timeline tracer.
+
+        :param output_dir: Directory to write the trace files.
+        :param interval: Trace one call in every "interval" calls.
+        :param name: Prefix of the trace file names.
+        :param top_k: Number of rows of each summary table.
+        :param show_memory: Show the memory allocations in the Chrome trace.
+        """
+        if interval < 1:
+            raise ValueError('interval should be a positive integer.')
+        self._output_dir = output_dir
+        self._interval = interval
+        self._name = name
+        self._top_k = top_k
+        self._show_memory = show_memory
+        self._count = 0
+        self._last_summary = None
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+    @property
+    def output_dir(self):
+        return self._output_dir
+
+    @property
+    def last_summary(self):
+        """The summary (dict) of the last traced call.
+        """
+        return self._last_summary
+
+    def step(self):
+        """Count a call.
+
+        :return: True if the call should be traced.
+        """
+        self._count += 1
+        #
+        # The first calls are usually slow for warming up, so the first trace is taken at the Nth call.
+        return self._count % self._interval == 0
+
+    def run(self, session, fetches, feed_dict):
+        """Run the fetches with full trace, and write the trace files.
+
+        :param session: The session.
+        :param fetches: Fetches.
+        :param feed_dict: Feed dict.
+        :return: The results of session.run().
+        """
+        from tensorflow.python.client import timeline
+        options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        ret = session.run(fetches=fetches, feed_dict=feed_dict, options=options, run_metadata=run_metadata)
+        step = self._count
+        path = os.path.join(self._output_dir, '%s-%d' % (self._name, step))
+        trace = timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format(
+            show_memory=self._show_memory
+        )
+        with open(path + '.json', 'w') as f:
+            f.write(trace)
+        self._last_summary = self._summarize(run_metadata.step_stats, session.graph)
+        with open(path + '.txt', 'w') as f:
+            f.write(self._format_summary(self._last_summary))
+        return ret
+
+    def _summarize(self, step_stats, graph):
+        #
+        # Longest names first, so that an op is counted to the innermost widget.
+        widget_names = sorted(widgets.Widget.INSTANCES.get(graph, {}).keys(), key=len, reverse=True)
+        op_time = collections.defaultdict(int)
+        op_bytes = collections.defaultdict(int)
+        for dev_stats in step_stats.dev_stats:
+            for node_stats in dev_stats.node_stats:
+                name = node_stats.node_name.split(':')[0]
+                op_time[name] += node_stats.op_end_rel_micros - node_stats.op_start_rel_micros
+                op_bytes[name] += sum(memory.total_bytes for memory in node_stats.memory)
+        widget_time = collections.defaultdict(int)
+        widget_bytes = collections.defaultdict(int)
+        for name in op_time:
+            widget_name = self._match_widget(name, widget_names)
+            widget_time[widget_name] += op_time[name]
+            widget_bytes[widget_name] += op_bytes[name]
+        return {
+            'op_time': self._top(op_time),
+            'op_bytes': self._top(op_bytes),
+            'widget_time': self._top(widget_time),
+            'widget_bytes': self._top(widget_bytes)
+        }
+
+    @staticmethod
+    def _match_widget(op_name, widget_names):
+        if op_name.startswith('gradients'):
+            op_name = op_name[op_name.find('/') + 1:]
+        for widget_name in widget_names:
+            if op_name.startswith(widget_name + '/'):
+                return widget_name
+        return '(others)'
+
+    def _top(self, value_dict):
+        return sorted(value_dict.items(), key=lambda a: a[1], reverse=True)[:self._top_k]
+
+    @staticmethod
+    def _format_summary(summary):
+        lines = []
+        for title, key, unit in (
+                ('Top ops by time', 'op_time', 'us'),
+                ('Top ops by allocated bytes', 'op_bytes', 'B'),
+                ('Top widgets by time', 'widget_time', 'us'),
+                ('Top widgets by allocated bytes', 'widget_bytes', 'B')):
+            lines.append('%s (%s)' % (title, unit))
+            for name, value in summary[key]:
+                lines.append('%16d  %s' % (value, name))
+            lines.append('')
+        return '\n'.join(lines)
+
+
 class Trainer(widgets.Widget):
     """Trainer
     """
@@ -134,6 +284,7 @@ class Trainer(widgets.Widget):
         self._slots = {}
         self._predict_slot = None
         self._fitters = collections.deque()
+        self._timer = None
         super(Trainer, self).__init__(name, build)
 
     # def __del__(self):
@@ -179,6 +330,9 @@ class Trainer(widgets.Widget):
     def _add_predict_slot(self, inputs=None, outputs=None, givens=None, updates=None):
         self._add_slot(settings.PREDICT, inputs, outputs, givens, updates)
 
+    def _add_apply_slot(self, inputs=None, outputs=None, givens=None, updates=None):
+        self._add_slot(settings.APPLY, inputs, outputs, givens, updates)
+
     def get_slot(self, name):
         return self._slots[name] if name in self._slots else None
 
@@ -188,9 +342,11 @@ class Trainer(widgets.Widget):
         :param max_loop: The number of max loop. Default is 10000.
             Here, "a loop" means train the model with one batch of data.
         """
+        self._timer = FitTimer()
         context = {
             settings.CONTEXT_TRAINER: self,
-            settings.CONTEXT_MAX_LOOP: max_loop
+            settings.CONTEXT_MAX_LOOP: max_loop,
+            settings.CONTEXT_TIMER: self._timer
         }
         for i in range(1, max_loop + 1):
             context[settings.CONTEXT_LOOP] = i
@@ -200,6 +356,12 @@ class Trainer(widgets.Widget):
                 except FitterInterrupt:
                     break
 
+    @property
+    def timer(self):
+        """The FitTimer of the last (or current) "fit" call.
+        """
+        return self._timer
+
     def add_fitter(self, fitter):
         self._fitters.append(fitter)
 
@@ -212,11 +374,43 @@ class Trainer(widgets.Widget):
     def add_data_trainer(self, data_source, batch_size, interval=1, count=1):
         self.add_fitter(DataFitter(data_source, batch_size, self, settings.TRAIN, interval, count))
 
+    def add_accumulating_trainer(self, data_source, batch_size, num_micro_batches, interval=1, count=1):
+        self.add_fitter(AccumulatingFitter(
+            data_source, batch_size, self, settings.TRAIN, settings.APPLY, num_micro_batches, interval, count
+        ))
+
     def add_data_validator(self, data_source, batch_size, interval=1, count=1):
         self.add_fitter(Validator(data_source, batch_size, self, settings.VALIDATE, interval, count))
 
-    def add_screen_logger(self, log_attr, value_names=('loss',), message=None, interval=1, count=1):
-        self.add_fitter(ScreenLogger(log_attr, value_names, message, interval, count))
+    def add_tracer(self, slot_name, output_dir, interval=100, top_k=20):
+        """Trace every Nth call of the slot, and write the Chrome traces and summaries to the output directory.
+
+        :param slot_name: Slot name.
+        :param output_dir: Directory to write the trace files.
+        :param interval: Trace one call in every "interval" calls.
+        :param top_k: Number of rows of each summary table.
+        :return: The TimelineTracer.
+        """
+        tracer = TimelineTracer(output_dir, interval, slot_name, top_k)
+        self.get_slot(slot_name).tracer = tracer
+        return tracer
+
+    def add_screen_logger(self, log_attr, value_names=('loss',), message=None, interval=1, count=1, timing=False):
+        self.add_fitter(ScreenLogger(log_attr, value_names, message, interval, count, timing))
+
+    def add_checkpoint(self, dumper, name='checkpoint', keep=5, interval=1000, widget=None):
+        """Dump the model every "interval" loops in background.
+
+        :param dumper: ModelDumper.
+        :param name: Prefix of the checkpoint names. The checkpoints are named as "{name}-{loop}".
+        :param keep: Number of the latest checkpoints to keep.
+        :param interval: Interval.
+        :param widget: The widget to dump. Default is the trainer itself.
+        :return: The CheckpointFitter.
+        """
+        fitter = CheckpointFitter(self if widget is None else widget, dumper, name, keep, interval)
+        self.add_fitter(fitter)
+        return fitter
 
     def predict(self, data_batch):
         if self._predict_slot is None:
@@ -234,6 +428,71 @@ class FitterInterrupt(BaseException):
         pass
 
 
+class FitTimer(object):
+    """Fit timer
+
+    Record the wall time (in seconds) of the fitters and keep a rolling window of the latest records for each key.
+    The keys used by the fitters are:
+
+        "{fitter_name}": The whole step of the fitter.
+        "{slot_name}/fetch": Time of DataSource.next_batch() in DataFitter.
+        "{slot_name}/run": Time of the Slot execution in DataFitter.
+        "{slot_name}/samples_per_sec": Throughput of DataFitter.
+
+    If "fetch" dominates "run", the job is input bound, else it is compute bound.
+    """
+
+    def __init__(self, window=100):
+        self._window = window
+        self._records = collections.OrderedDict()
+
+    @property
+    def window(self):
+        return self._window
+
+    def record(self, key, value):
+        if key not in self._records:
+            self._records[key] = collections.deque(maxlen=self._window)
+        self._records[key].append(value)
+
+    def keys(self):
+        return list(self._records.keys())
+
+    def last(self, key):
+        records = self._records.get(key)
+        return records[-1] if records else None
+
+    def mean(self, key):
+        records = self._records.get(key)
+        return float(np.mean(records)) if records else None
+
+    def percentile(self, key, q):
+        """Compute the q-th percentile of the records in the rolling window.
+
+        :param key: The key.
+        :param q: Percentile, in range [0, 100]. Can also be a sequence of percentiles.
+        :return: The percentile(s), or None if there is no record.
+        """
+        records = self._records.get(key)
+        return np.percentile(records, q) if records else None
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Get the statistics of all the keys.
+
+        :param percentiles: Percentiles to compute.
+        :return: dict[str, dict[str, float]], e.g., {'train/run': {'mean': 0.03, 'p50': 0.02, ...}}.
+        """
+        ret = collections.OrderedDict()
+        for key, records in self._records.items():
+            if not records:
+                continue
+            stat = {'mean': float(np.mean(records))}
+            for q, value in zip(percentiles, np.percentile(records, percentiles)):
+                stat['p%s' % str(q)] = float(value)
+            ret[key] = stat
+        return ret
+
+
 class Fitter(object):
     """Fitter
     """
@@ -244,10 +503,20 @@ class Fitter(object):
         self._interval = interval
         self._count = count
 
+    @property
+    def name(self):
+        """Name used as the key of the timing records.
+        """
+        return self.__class__.__name__
+
     def fit(self, i, max_loop, context):
         if i % self._interval == 0:
+            timer = context.get(settings.CONTEXT_TIMER)
             for _ in range(self._count):
+                start = time.perf_counter()
                 self._fit(i, max_loop, context)
+                if timer is not None:
+                    timer.record(self.name, time.perf_counter() - start)
 
     def _fit(self, i, max_loop, context):
         raise NotImplementedError()
@@ -277,11 +546,87 @@ class DataFitter(Fitter):
         self._slot_name = slot_name
         self._slot = trainer.get_slot(slot_name)
 
+    @property
+    def name(self):
+        return self._slot_name
+
     def _fit(self, i, max_loop, context):
+        start = time.perf_counter()
         data_batch = self._ds.next_batch(self._batch_size)
+        fetched = time.perf_counter()
         ret = self._slot(*data_batch)
+        self._record_time(context, start, fetched, time.perf_counter(), len(data_batch[0]))
         context[self._slot_name] = ret
 
+    def _record_time(self, context, start, fetched, end, size):
+        timer = context.get(settings.CONTEXT_TIMER)
+        if timer is None:
+            return
+        timer.record(self._slot_name + '/fetch', fetched - start)
+        timer.record(self._slot_name + '/run', end - fetched)
+        if end > start:
+            timer.record(self._slot_name + '/samples_per_sec', size / (end - start))
+
+
+class AccumulatingFitter(DataFitter):
+    """Accumulating fitter
+
+    Split one logical batch into several micro batches.
+    The slot (which should accumulate the gradients, see AccumulatingOptimizer) is run on each micro batch,
+    and then the apply slot is run once to update the parameters.
+    The micro batches must have the same size, since AccumulatingOptimizer averages the gradients over the micro
+    batches (not the samples). So the batch size should be divisible by num_micro_batches.
+    """
+
+    def __init__(self,
+                 data_source,
+                 batch_size,
+                 trainer,
+                 slot_name,
+                 apply_slot_name,
+                 num_micro_batches,
+                 interval=1,
+                 count=1):
+        super(AccumulatingFitter, self).__init__(
+            data_source=data_source,
+            batch_size=batch_size,
+            trainer=trainer,
+            slot_name=slot_name,
+            interval=interval,
+            count=count
+        )
+        if num_micro_batches <= 0:
+            raise ValueError('num_micro_batches should be positive.')
+        if batch_size % num_micro_batches != 0:
+            raise ValueError('batch_size should be divisible by num_micro_batches.')
+        self._num_micro_batches = num_micro_batches
+        self._apply_slot_name = apply_slot_name
+        self._apply_slot = trainer.get_slot(apply_slot_name)
+        if self._apply_slot is None:
+            raise ValueError('The trainer has no slot named "%s". '
+                             'Add it with "_add_apply_slot()" (e.g., updates=optimizer.apply_op).' % apply_slot_name)
+
+    def _fit(self, i, max_loop, context):
+        start_time = time.perf_counter()
+        data_batch = self._ds.next_batch(self._batch_size)
+        fetched_time = time.perf_counter()
+        size = len(data_batch[0])
+        if size % self._num_micro_batches != 0:
+            raise ValueError('The size of the batch (%d) is not divisible by num_micro_batches (%d).' % (
+                size, self._num_micro_batches
+            ))
+        micro_batch_size = size // self._num_micro_batches
+        ret_list = []
+        for start in range(0, size, micro_batch_size):
+            micro_batch = tuple(comp[start: start + micro_batch_size] for comp in data_batch)
+            ret_list.append(self._slot(*micro_batch))
+        self._apply_slot()
+        self._record_time(context, start_time, fetched_time, time.perf_counter(), size)
+        if isinstance(ret_list[0], (dict, collections.OrderedDict)):
+            context[self._slot_name] = {name: np.mean([ret[name] for ret in ret_list], axis=0) for name in ret_list[0]}
+        else:
+            context[self._slot_name] = tuple(comp for comp in np.mean(ret_list, axis=0))
+
 
 class Validator(DataFitter):
     """Validator
@@ -365,11 +710,13 @@ class ScreenLogger(Fitter):
                  value_names=('loss',),
                  message=None,
                  interval=1,
-                 count=1):
+                 count=1,
+                 timing=False):
         super(ScreenLogger, self).__init__(interval, count)
         self._context = context
         self._value_names = value_names
         self._message = message
+        self._timing = timing
 
     def _fit(self, i, max_loop, context):
         now = dt.datetime.now()
@@ -395,9 +742,121 @@ class ScreenLogger(Fitter):
                     print('\t%s=%f' % (name, value), end='')
                 else:
                     print('\t%s=?' % (name,), end='')
+        #
+        timer = context.get(settings.CONTEXT_TIMER)
+        if self._timing and timer is not None:
+            for key in timer.keys():
+                if key.endswith('/fetch'):
+                    name = key[:-len('/fetch')]
+                    print('\t%s:fetch=%.1fms,run=%.1fms,%.1f/s' % (
+                        name,
+                        timer.percentile(name + '/fetch', 50) * 1000,
+                        timer.percentile(name + '/run', 50) * 1000,
+                        timer.percentile(name + '/samples_per_sec', 50) or 0
+                    ), end='')
         print()
 
 
+class CheckpointFitter(Fitter):
+    """Checkpoint fitter
+
+    Snapshot the parameters with one session run, and dump them with a background writer thread.
+    So the training loop is not blocked by the serialization and the IO.
+    At most one snapshot waits for the writer. If a new snapshot is taken while another one is still waiting (i.e.,
+    the writes are slower than the interval), the waiting one is dropped and counted by "num_skipped".
+    So at most two snapshots (the one being written and the waiting one) are held in memory.
+    """
+
+    def __init__(self,
+                 widget,
+                 dumper,
+                 name='checkpoint',
+                 keep=5,
+                 interval=1000,
+                 count=1,
+                 atomic=True):
+        """Create a checkpoint fitter.
+
+        :param widget: The widget to dump.
+        :param dumper: ModelDumper.
+        :param name: Prefix of the checkpoint names. The checkpoints are named as "{name}-{loop}".
+        :param keep: Number of the latest checkpoints to keep. None means keeping all of them.
+        :param interval: Interval.
+        :param count: Count.
+        :param atomic: Write the checkpoints atomically (a temporary name plus rename).
+        """
+        super(CheckpointFitter, self).__init__(interval, count)
+        if keep is not None and keep < 1:
+            raise ValueError('keep should be a positive integer or None.')
+        self._widget = widget
+        self._dumper = dumper
+        self._name = name
+        self._keep = keep
+        self._atomic = atomic
+        self._checkpoints = collections.deque()
+        self._cond = threading.Condition()
+        self._pending = None
+        self._thread = None
+        self._num_skipped = 0
+        self._error = None
+
+    @property
+    def checkpoints(self):
+        """Names of the checkpoints that have been written and kept, the latest is the last one.
+        """
+        return list(self._checkpoints)
+
+    @property
+    def num_skipped(self):
+        """Number of the snapshots dropped because the writer was busy.
+        """
+        return self._num_skipped
+
+    def _fit(self, i, max_loop, context):
+        self._check_error()
+        param_dict = self._widget.get_parameters()
+        with self._cond:
+            if self._pending is not None:
+                self._num_skipped += 1
+            self._pending = ('%s-%d' % (self._name, i), param_dict)
+            if self._thread is None:
+                #
+                # The writer exits when there is nothing to write, so it never keeps the process alive.
+                self._thread = threading.Thread(target=self._write)
+                self._thread.start()
+
+    def _write(self):
+        while True:
+            with self._cond:
+                if self._pending is None:
+                    self._thread = None
+                    self._cond.notify_all()
+                    return
+                name, param_dict = self._pending
+                self._pending = None
+            try:
+                self._dumper.dump_params(param_dict, name, self._atomic)
+                self._checkpoints.append(name)
+                while self._keep is not None and len(self._checkpoints) > self._keep:
+                    self._dumper.delete(self._checkpoints.popleft())
+            except Exception as e:
+                self._error = e
+            del param_dict
+
+    def wait(self):
+        """Wait until all the checkpoints are written.
+        """
+        with self._cond:
+            while self._thread is not None:
+                self._cond.wait()
+        self._check_error()
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('Failed to write checkpoint.') from error
+
+
 class MPIDispatcher(Fitter):
     """MPI Dispatcher
 
@@ -464,29 +923,54 @@ class OptimizerWrapper(object):
     """
 
     def __init__(self,
-                 optimizer):
+                 optimizer,
+                 weight_decay=None):
+        """Wrap an optimizer.
+
+        :param optimizer: tf.train.Optimizer.
+        :param weight_decay: Decoupled weight decay rate. If given, each updated variable is shrunk by
+            "var -= weight_decay * var" after the gradients are applied, instead of adding a L2 loss
+            (and its gradients) to the objective.
+        """
         self._optimizer = optimizer
+        self._weight_decay = weight_decay
 
     @property
     def optimizer(self):
         return self._optimizer
 
+    @property
+    def weight_decay(self):
+        return self._weight_decay
+
     def minimize(self, loss, var_list=None):
         pair_list = self._optimizer.compute_gradients(loss, var_list=var_list)
         pair_list = self._process_gradients(pair_list)
-        return self._optimizer.apply_gradients(pair_list)
+        return self._apply_gradients(pair_list)
 
     def _process_gradients(self, pair_list):
         raise NotImplementedError
 
+    def _apply_gradients(self, pair_list):
+        apply_op = self._optimizer.apply_gradients(pair_list)
+        if self._weight_decay is None:
+            return apply_op
+        with tf.control_dependencies([apply_op]):
+            decay_list = [
+                var.assign_sub(self._weight_decay * var)
+                for grad, var in pair_list
+                if grad is not None
+            ]
+        return tf.group(*decay_list)
+
 
 class GradientClipping(OptimizerWrapper):
     """GradientClipping
     """
 
-    def __init__(self, optimizer, max_norm):
+    def __init__(self, optimizer, max_norm, weight_decay=None):
         self._max_norm = max_norm
-        super(GradientClipping, self).__init__(optimizer)
+        super(GradientClipping, self).__init__(optimizer, weight_decay)
 
     @property
     def max_norm(self):
@@ -505,3 +989,63 @@ class GradientClipping(OptimizerWrapper):
     @property
     def grad_norm(self):
         return self._grad_norm
+
+
+class AccumulatingOptimizer(OptimizerWrapper):
+    """AccumulatingOptimizer
+
+    Accumulate the gradients of several (micro) batches, and then apply the averaged gradients once.
+    So a large effective batch can be trained with the peak memory of a micro batch.
+    "minimize" returns the accumulate operator, while "apply_op" applies the averaged gradients and
+    resets the accumulators. See also AccumulatingFitter.
+    """
+
+    def __init__(self, optimizer, weight_decay=None):
+        self._count = None
+        self._accum_list = None
+        self._apply_op = None
+        super(AccumulatingOptimizer, self).__init__(optimizer, weight_decay)
+
+    def minimize(self, loss, var_list=None):
+        pair_list = self._optimizer.compute_gradients(loss, var_list=var_list)
+        pair_list = [(grad, var) for grad, var in pair_list if grad is not None]
+        with tf.name_scope('accumulate'):
+            self._count = tf.Variable(0.0, dtype=settings.D_TYPE, trainable=False, name='count')
+            self._accum_list = [
+                tf.Variable(
+                    tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype),
+                    trainable=False,
+                    name='accum'
+                )
+                for _, var in pair_list
+            ]
+            update_list = [self._count.assign_add(1.0)]
+            for (grad, _), accum in zip(pair_list, self._accum_list):
+                if isinstance(grad, tf.IndexedSlices):
+                    #
+                    # Sparse gradients (e.g., from Embedding) only touch the selected rows.
+                    update_list.append(tf.scatter_add(accum, grad.indices, grad.values))
+                else:
+                    update_list.append(accum.assign_add(grad))
+            accumulate_op = tf.group(*update_list)
+        with tf.name_scope('apply'):
+            count = tf.maximum(self._count, 1.0)
+            avg_list = [(accum / count, var) for accum, (_, var) in zip(self._accum_list, pair_list)]
+            avg_list = self._process_gradients(avg_list)
+            apply_op = self._apply_gradients(avg_list)
+            with tf.control_dependencies([apply_op]):
+                reset_list = [accum.assign(tf.zeros_like(accum)) for accum in self._accum_list]
+                reset_list.append(self._count.assign(0.0))
+                self._apply_op = tf.group(*reset_list)
+        return accumulate_op
+
+    def _process_gradients(self, pair_list):
+        return pair_list
+
+    @property
+    def apply_op(self):
+        return self._apply_op
+
+    @property
+    def count(self):
+        return self._count
@@ -5,27 +5,52 @@
 @since: 2017-12-25
 """
 
+import collections
+import concurrent.futures
 import os
 import random
+import threading
 
 import numpy as np
-import scipy.ndimage as ndi
-from PIL import Image
 
 import photinia as ph
 
 
-def load_as_array(fn_or_fp, height, width):
+def _open_resized(fn_or_fp, height, width, resample=None, draft=False):
+    """Open an image and resize it.
+
+    :param fn_or_fp: File name or file object.
+    :param height: Height.
+    :param width: Width.
+    :param resample: Resampling filter of PIL, e.g., Image.LANCZOS. None means PIL's default filter.
+    :param draft: If True, JPEG images are decoded at a reduced size with DCT scaling (the smallest scale that is not
+        smaller than the target size), which is much faster when the target is far smaller than the source.
+    :return: The resized PIL image.
+    """
+    from PIL import Image
+    image = Image.open(fn_or_fp)
+    if draft:
+        image.draft(image.mode, (width, height))
+    if resample is None:
+        return image.resize((width, height))
+    return image.resize((width, height), resample)
+
+
+def load_as_array(fn_or_fp, height, width, resample=None, draft=False):
     """Load an image from file and convert it into array.
     The data type of the array is np.uint8.
 
     :param fn_or_fp: File name or file object.
     :param height: Height.
     :param width: Width.
+    :param resample: Resampling filter of PIL. None means Image.LANCZOS.
+    :param draft: Decode JPEG images at a reduced size before resizing.
     :return: An array represents the image.
     """
-    image = Image.open(fn_or_fp)
-    image = image.resize((width, height), Image.LANCZOS)
+    if resample is None:
+        from PIL import Image
+        resample = Image.LANCZOS
+    image = _open_resized(fn_or_fp, height, width, resample, draft)
     return np.asarray(image, dtype=np.uint8)
 
 
@@ -37,6 +62,7 @@ def save_array(fn_or_fp, array):
     :param array: The array.
     :return: None.
     """
+    from PIL import Image
     image = Image.fromarray(array)
     image.save(fn_or_fp)
 
@@ -52,6 +78,7 @@ def array_to_mat(array, height=None, width=None):
     :return: The matrix.
     """
     if height is not None and width is not None:
+        from PIL import Image
         image = Image.fromarray(array)
         image = image.resize((width, height), Image.LANCZOS)
         return (np.asarray(image, dtype=np.float32) - 128.0) / 130.0
@@ -69,7 +96,7 @@ def mat_to_array(mat):
     return (mat * 128.0 + 127.75).astype(np.uint8)
 
 
-def load_as_mat(fn_or_fp, height, width):
+def load_as_mat(fn_or_fp, height, width, resample=None, draft=False):
     """Load an image from file and convert it into matrix.
     The data type of the array is np.float32.
     Elements in the matrix must be valued in range -1 ~ 1.
@@ -77,10 +104,11 @@ def load_as_mat(fn_or_fp, height, width):
     :param fn_or_fp: File name or file object.
     :param height: Height.
     :param width: Width.
+    :param resample: Resampling filter of PIL. None means PIL's default filter.
+    :param draft: Decode JPEG images at a reduced size before resizing.
     :return: An matrix represents the image.
     """
-    image = Image.open(fn_or_fp)
-    image = image.resize((width, height))
+    image = _open_resized(fn_or_fp, height, width, resample, draft)
     return (np.asarray(image, dtype=np.float32) - 128.0) / 128.0
 
 
@@ -96,8 +124,112 @@ def save_mat(fn_or_fp, mat):
     save_array(fn_or_fp, array)
 
 
+def _load_as_uint8(fn_or_fp, height, width, resample=None, draft=False):
+    """Load an image as "load_as_mat()" does, but keep the uint8 pixels.
+    """
+    image = _open_resized(fn_or_fp, height, width, resample, draft)
+    return np.asarray(image, dtype=np.uint8)
+
+
+def _uint8_to_mat(array):
+    """Convert uint8 pixels into matrix, the same as "load_as_mat()".
+    """
+    return (array.astype(np.float32) - 128.0) / 128.0
+
+
+class ImageCache(object):
+    """LRU image cache.
+
+    The cache is bounded by the total bytes and (or) the number of items.
+    When it is full, the least recently used item is evicted.
+    Store the images as uint8 arrays, which cost 1/4 of the memory of float32 matrices.
+    """
+
+    def __init__(self, max_bytes=0, max_items=0):
+        """Create an image cache.
+
+        :param max_bytes: Max total bytes of the cached arrays. 0 means no limit.
+        :param max_items: Max number of the cached items. 0 means no limit.
+        """
+        self._max_bytes = max_bytes
+        self._max_items = max_items
+        self._items = collections.OrderedDict()
+        self._num_bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @property
+    def max_items(self):
+        return self._max_items
+
+    @property
+    def num_bytes(self):
+        return self._num_bytes
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def hit_rate(self):
+        total = self._hits + self._misses
+        return self._hits / total if total > 0 else 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        """Get an item, and mark it as the most recently used one.
+
+        :param key: The key.
+        :return: The cached value, or None if the key is not cached.
+        """
+        item = self._items.get(key)
+        if item is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, value):
+        """Put an item into the cache.
+
+        :param key: The key.
+        :param value: np.ndarray or tuple of np.ndarray.
+        """
+        size = sum(a.nbytes for a in value) if isinstance(value, tuple) else value.nbytes
+        if key in self._items:
+            self._num_bytes -= self._items.pop(key)[1]
+        if 0 < self._max_bytes < size:
+            return
+        self._items[key] = (value, size)
+        self._num_bytes += size
+        while (0 < self._max_bytes < self._num_bytes) or (0 < self._max_items < len(self._items)):
+            _, (_, size) = self._items.popitem(last=False)
+            self._num_bytes -= size
+
+    def clear(self):
+        self._items.clear()
+        self._num_bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+
 class BufferedImageSource(ph.DataSource):
     """Image data source.
+    The decoded images are cached as uint8 arrays, and converted into float32 matrices when a batch is assembled.
     """
 
     def __init__(self,
@@ -105,7 +237,17 @@ class BufferedImageSource(ph.DataSource):
                  height,
                  width,
                  depth=3,
-                 buffer_size=0):
+                 buffer_size=0,
+                 buffer_bytes=0):
+        """Image data source.
+
+        :param image_dir: The image directory.
+        :param height: Height.
+        :param width: Width.
+        :param depth: Depth (number of channels).
+        :param buffer_size: Max number of cached images. 0 means no limit.
+        :param buffer_bytes: Max bytes of cached images. 0 means no limit.
+        """
         self._height = height
         self._width = width
         self._depth = depth
@@ -113,26 +255,28 @@ class BufferedImageSource(ph.DataSource):
         #
         file_list = [os.path.join(image_dir, img_file) for img_file in os.listdir(image_dir)]
         self._dataset = ph.Dataset(file_list).shuffle()
-        self._buffer = {}
+        self._cache = ImageCache(buffer_bytes, buffer_size)
+
+    @property
+    def cache(self):
+        return self._cache
 
     def next_batch(self, size=0):
-        mat_list = []
+        array_list = []
         image_files, = self._dataset.next_batch(size)
         for i, image_file in enumerate(image_files):
-            if image_file in self._buffer:
-                mat = self._buffer[image_file]
-            else:
-                mat = load_as_mat(image_file, self._width, self._height)
-                mat = mat.reshape((self._width, self._height, self._depth))
-                self._buffer[image_file] = mat
-                if 0 < self._buffer_size < len(self._buffer):
-                    self._buffer.popitem()
-            mat_list.append(mat)
-        return mat_list,
+            array = self._cache.get(image_file)
+            if array is None:
+                array = _load_as_uint8(image_file, self._height, self._width)
+                array = array.reshape((self._height, self._width, self._depth))
+                self._cache.put(image_file, array)
+            array_list.append(array)
+        return _uint8_to_mat(np.stack(array_list, axis=0)),
 
 
 class ImageSourceWithLabels(ph.DataSource):
     """Image data source.
+    The decoded images are cached as uint8 arrays, and converted into float32 matrices when a batch is assembled.
     """
 
     def __init__(self,
@@ -141,7 +285,19 @@ class ImageSourceWithLabels(ph.DataSource):
                  width,
                  depth,
                  num_classes,
-                 buffer_size=0):
+                 buffer_size=0,
+                 buffer_bytes=0):
+        """Image data source with labels.
+        The label of an image is read from the ".txt" file with the same name.
+
+        :param image_dir: The image directory.
+        :param height: Height.
+        :param width: Width.
+        :param depth: Depth (number of channels).
+        :param num_classes: Number of classes.
+        :param buffer_size: Max number of cached images. 0 means no limit.
+        :param buffer_bytes: Max bytes of cached images. 0 means no limit.
+        """
         self._height = height
         self._width = width
         self._depth = depth
@@ -154,60 +310,307 @@ class ImageSourceWithLabels(ph.DataSource):
             if not img_file.endswith('.txt')
         ]
         self._dataset = ph.Dataset(file_list).shuffle()
-        self._buffer = {}
+        self._cache = ImageCache(buffer_bytes, buffer_size)
+
+    @property
+    def cache(self):
+        return self._cache
 
     def next_batch(self, size=0):
-        mat_list = []
+        array_list = []
         onehot_list = []
         files, = self._dataset.next_batch(size)
         for i, file_ in enumerate(files):
-            if file_ in self._buffer:
-                mat, onehot = self._buffer[file_]
-            else:
-                mat = load_as_mat(file_, self._height, self._width)
-                mat = mat.reshape((self._height, self._width, self._depth))
+            item = self._cache.get(file_)
+            if item is None:
+                array = _load_as_uint8(file_, self._height, self._width)
+                array = array.reshape((self._height, self._width, self._depth))
                 with open(os.path.splitext(file_)[0] + '.txt', 'rt') as f:
                     label = int(f.readline())
                 onehot = np.zeros((self._num_classes,), dtype=np.float32)
                 onehot[label % self._num_classes] = 1.0
-                self._buffer[file_] = (mat, onehot)
-                if 0 < self._buffer_size < len(self._buffer):
-                    self._buffer.popitem()
-            mat_list.append(mat)
+                item = (array, onehot)
+                self._cache.put(file_, item)
+            array, onehot = item
+            array_list.append(array)
             onehot_list.append(onehot)
-        return mat_list, onehot_list
+        return _uint8_to_mat(np.stack(array_list, axis=0)), np.stack(onehot_list, axis=0)
 
 
 class ImageSource(ph.DataSource):
     """Image data source.
+
+    The images of a batch are decoded by a thread pool (PIL releases the GIL while decoding and resizing), and the
+    next batch is read ahead in background while the current one is being used.
+    The images failed to load are left as zeros, and counted by "num_failures".
     """
 
     def __init__(self,
                  image_dir,
                  height,
                  width,
-                 channels):
+                 channels,
+                 num_threads=4,
+                 readahead=True):
+        """Image data source.
+
+        :param image_dir: The image directory.
+        :param height: Height.
+        :param width: Width.
+        :param channels: Number of channels.
+        :param num_threads: Number of decoding threads.
+        :param readahead: Decode the next batch in background.
+        """
+        if num_threads < 1:
+            raise ValueError('num_threads should be a positive integer.')
         self._height = height
         self._width = width
         self._channels = channels
+        self._num_threads = num_threads
+        self._readahead = readahead
         #
         file_list = [
             os.path.join(image_dir, file_) for file_ in os.listdir(image_dir)
         ]
         file_list = [file_ for file_ in file_list if os.path.isfile(file_)]
         self._dataset = ph.Dataset(file_list).shuffle()
+        #
+        self._executor = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._num_failures = 0
+        self._last_error = None
+
+    @property
+    def num_failures(self):
+        """Number of the images failed to load.
+        """
+        return self._num_failures
+
+    @property
+    def last_error(self):
+        """The last exception raised when loading an image, and the file name.
+        """
+        return self._last_error
 
     def next_batch(self, size=0):
-        mat_list = np.zeros((size, self._height, self._width, self._channels), dtype=np.float32)
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(self._num_threads)
+        pending, self._pending = self._pending, None
+        if pending is None or pending[0] != size:
+            pending = self._submit(size)
+        if self._readahead:
+            self._pending = self._submit(size)
+        _, mat_list, futures = pending
+        concurrent.futures.wait(futures)
+        return mat_list,
+
+    def next_keys(self, size=0):
+        """Draw the file names of the next batch, without loading the images.
+        The images can then be loaded by "load_batch()" somewhere else, e.g., in the workers of AugmentedImageSource.
+
+        :param size: Batch size.
+        :return: Array of the file names.
+        """
         image_files, = self._dataset.next_batch(size)
+        return image_files
+
+    def load_batch(self, image_files):
+        """Load the images of the given files in the current thread.
+
+        :param image_files: File names got by "next_keys()".
+        :return: A batch like "next_batch()" returns.
+        """
+        mat_list = np.zeros((len(image_files), self._height, self._width, self._channels), dtype=np.float32)
         for i, image_file in enumerate(image_files):
-            try:
-                mat_list[i] = load_as_mat(image_file, self._width, self._height)
-            except Exception as e:
-                print(e)
-                continue
+            self._load(mat_list, i, image_file)
         return mat_list,
 
+    def _submit(self, size):
+        image_files = self.next_keys(size)
+        mat_list = np.zeros((len(image_files), self._height, self._width, self._channels), dtype=np.float32)
+        futures = [
+            self._executor.submit(self._load, mat_list, i, image_file)
+            for i, image_file in enumerate(image_files)
+        ]
+        return size, mat_list, futures
+
+    def _load(self, mat_list, i, image_file):
+        try:
+            mat = load_as_mat(image_file, self._height, self._width)
+            mat_list[i] = mat.reshape((self._height, self._width, self._channels))
+        except Exception as e:
+            with self._lock:
+                self._num_failures += 1
+                self._last_error = (image_file, e)
+
+    def close(self):
+        """Shutdown the decoding threads.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            self._pending = None
+
+
+def pack_images(image_dir,
+                output_dir,
+                height,
+                width,
+                depth=3,
+                shard_size=1024,
+                label_suffix='.txt',
+                resample=None,
+                draft=False):
+    """Pack an image directory into fixed-size shards of pre-resized uint8 images, with an index.
+    It is a one-time conversion. Then "PackedImageSource" reads the images without opening or decoding image files.
+
+    The output directory looks like:
+
+        shard-00000.npy: uint8 array with shape (shard_size, height, width, depth).
+        shard-00001.npy
+        ...
+        index.npz: "labels" (int64, -1 if an image has no label), "shards" (int32), "offsets" (int32), "files" and
+            the image shape.
+
+    :param image_dir: The image directory.
+    :param output_dir: The output directory.
+    :param height: Height.
+    :param width: Width.
+    :param depth: Depth (number of channels).
+    :param shard_size: Number of images in each shard.
+    :param label_suffix: The label of an image is read from the file with the same name and this suffix (e.g.,
+        "cat_001.jpg" -> "cat_001.txt") if it exists. None means no labels.
+    :param resample: Resampling filter of PIL. None means PIL's default filter.
+    :param draft: Decode JPEG images at a reduced size before resizing.
+    :return: Number of the packed images.
+    """
+    if shard_size < 1:
+        raise ValueError('shard_size should be a positive integer.')
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    file_list = sorted(
+        file_ for file_ in os.listdir(image_dir)
+        if os.path.isfile(os.path.join(image_dir, file_))
+        and (label_suffix is None or not file_.endswith(label_suffix))
+    )
+    labels = np.full((len(file_list),), -1, dtype=np.int64)
+    shards = np.zeros((len(file_list),), dtype=np.int32)
+    offsets = np.zeros((len(file_list),), dtype=np.int32)
+    for shard_id, start in enumerate(range(0, len(file_list), shard_size)):
+        shard_files = file_list[start:start + shard_size]
+        shard = np.zeros((len(shard_files), height, width, depth), dtype=np.uint8)
+        for offset, file_ in enumerate(shard_files):
+            index = start + offset
+            path = os.path.join(image_dir, file_)
+            shard[offset] = _load_as_uint8(path, height, width, resample, draft).reshape((height, width, depth))
+            shards[index] = shard_id
+            offsets[index] = offset
+            if label_suffix is not None:
+                label_file = os.path.splitext(path)[0] + label_suffix
+                if os.path.exists(label_file):
+                    with open(label_file, 'rt') as f:
+                        labels[index] = int(f.readline())
+        np.save(os.path.join(output_dir, 'shard-%05d.npy' % shard_id), shard)
+    np.savez(
+        os.path.join(output_dir, 'index.npz'),
+        labels=labels,
+        shards=shards,
+        offsets=offsets,
+        files=np.array(file_list),
+        shape=np.array((height, width, depth))
+    )
+    return len(file_list)
+
+
+class PackedImageSource(ph.DataSource):
+    """Image data source reading the shards written by "pack_images()".
+    The shards are memory-mapped, so a batch is gathered from the page cache, without opening or decoding any image
+    file. The batches are shuffled over the whole dataset.
+    The images without labels are stored with label -1. They can't be converted into one-hot vectors, so either skip
+    them with "labeled_only" or leave "num_classes" as None.
+    """
+
+    def __init__(self,
+                 pack_dir,
+                 num_classes=None,
+                 with_labels=True,
+                 labeled_only=False):
+        """Packed image data source.
+
+        :param pack_dir: The directory written by "pack_images()".
+        :param num_classes: If given, the labels are converted into one-hot vectors.
+            A ValueError is raised if there are images without labels, unless "labeled_only" is True.
+        :param with_labels: Return the labels as the second column of the batches.
+        :param labeled_only: Skip the images without labels.
+        """
+        self._num_classes = num_classes
+        self._with_labels = with_labels
+        with np.load(os.path.join(pack_dir, 'index.npz')) as index:
+            self._labels = index['labels']
+            self._shard_ids = index['shards']
+            self._offsets = index['offsets']
+            self._shape = tuple(int(a) for a in index['shape'])
+        num_shards = int(self._shard_ids.max()) + 1 if len(self._shard_ids) > 0 else 0
+        self._shards = [
+            np.load(os.path.join(pack_dir, 'shard-%05d.npy' % shard_id), mmap_mode='r')
+            for shard_id in range(num_shards)
+        ]
+        indexes = np.arange(len(self._labels))
+        if labeled_only:
+            indexes = indexes[self._labels >= 0]
+        elif num_classes is not None and np.any(self._labels < 0):
+            raise ValueError(
+                'There are %d images without labels. Set "labeled_only" to skip them.' % np.sum(self._labels < 0)
+            )
+        self._dataset = ph.Dataset(indexes).shuffle()
+
+    @property
+    def size(self):
+        return self._dataset.size
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def next_batch(self, size=0):
+        return self.load_batch(self.next_keys(size))
+
+    def next_keys(self, size=0):
+        """Draw the image indexes of the next batch, without reading the images.
+
+        :param size: Batch size.
+        :return: Array of the image indexes.
+        """
+        indexes, = self._dataset.next_batch(size)
+        return indexes
+
+    def load_batch(self, indexes):
+        """Read the images of the given indexes.
+
+        :param indexes: Image indexes got by "next_keys()".
+        :return: A batch like "next_batch()" returns.
+        """
+        array_batch = np.empty((len(indexes),) + self._shape, dtype=np.uint8)
+        shard_ids = self._shard_ids[indexes]
+        offsets = self._offsets[indexes]
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            #
+            # Sorted offsets make the reads from the memory map sequential.
+            order = np.argsort(offsets[mask])
+            positions = np.nonzero(mask)[0][order]
+            array_batch[positions] = self._shards[shard_id][offsets[mask][order]]
+        mat_batch = _uint8_to_mat(array_batch)
+        if not self._with_labels:
+            return mat_batch,
+        labels = self._labels[indexes]
+        if self._num_classes is not None:
+            onehot = np.zeros((len(labels), self._num_classes), dtype=np.float32)
+            onehot[np.arange(len(labels)), labels % self._num_classes] = 1.0
+            labels = onehot
+        return mat_batch, labels
+
 
 def _trans_mat_offset_center(mat, x, y):
     o_x = float(x) / 2 + 0.5
@@ -235,6 +638,7 @@ def _apply_transform(mat,
             of the input if `mode='constant'`.
     :return: The transformed version of the input.
     """
+    import scipy.ndimage as ndi
     mat = np.rollaxis(mat, channel_axis, 0)
     final_affine_matrix = trans_mat[:2, :2]
     final_offset = trans_mat[:2, 2]
@@ -250,6 +654,102 @@ def _apply_transform(mat,
     return mat
 
 
+def _apply_transform_batch(mats,
+                           trans_mats,
+                           row_axis=0,
+                           col_axis=1,
+                           channel_axis=2,
+                           fill_mode='nearest',
+                           const_value=0.):
+    """Apply the image transformations to a batch of images.
+    The sampling coordinates of the whole batch are computed in one vectorized step on a stacked grid.
+    The result is the same as calling "_apply_transform" image by image.
+
+    :param mats: Numpy array of images. The axes of each image are given by row_axis, col_axis and channel_axis.
+    :param trans_mats: Numpy array of transform matrices, with shape (batch_size, 3, 3).
+    :param row_axis: Index of axis for rows in each image.
+    :param col_axis: Index of axis for columns in each image.
+    :param channel_axis: Index of axis for channels in each image.
+    :param fill_mode: Points outside the boundaries of the input
+            are filled according to the given mode
+            (one of `{'constant', 'nearest', 'reflect', 'wrap'}`).
+    :param const_value: Value used for points outside the boundaries
+            of the input if `mode='constant'`.
+    :return: The transformed images.
+    """
+    mats = np.moveaxis(mats, (row_axis + 1, col_axis + 1, channel_axis + 1), (1, 2, 3))
+    n, h, w, c = mats.shape
+    rows, cols = np.meshgrid(np.arange(h, dtype=np.float64), np.arange(w, dtype=np.float64), indexing='ij')
+    grid = np.stack((rows, cols), axis=0).reshape((2, -1))
+    #
+    # (n, 2, 2) x (2, h * w) + (n, 2, 1) -> (n, 2, h * w)
+    coords = np.matmul(trans_mats[:, :2, :2], grid) + trans_mats[:, :2, 2:3]
+    if fill_mode in ('nearest', 'constant'):
+        #
+        # Nearest neighbor sampling (order=0) is a gather of all the channels at once.
+        row_index = np.clip(np.floor(coords[:, 0] + 0.5).astype(np.intp), 0, h - 1)
+        col_index = np.clip(np.floor(coords[:, 1] + 0.5).astype(np.intp), 0, w - 1)
+        output = mats[np.arange(n).reshape((n, 1)), row_index, col_index]
+        if fill_mode == 'constant':
+            outside = (coords[:, 0] < 0) | (coords[:, 0] > h - 1) | (coords[:, 1] < 0) | (coords[:, 1] > w - 1)
+            output[outside] = const_value
+        output = output.reshape((n, h, w, c))
+    else:
+        import scipy.ndimage as ndi
+        batch_index = np.broadcast_to(np.arange(n, dtype=np.float64).reshape((n, 1)), (n, h * w))
+        coords = np.stack((batch_index, coords[:, 0, :], coords[:, 1, :]), axis=0).reshape((3, n, h, w))
+        output = np.empty(mats.shape, dtype=mats.dtype)
+        for i in range(c):
+            output[..., i] = ndi.map_coordinates(
+                mats[..., i],
+                coords,
+                order=0,
+                mode=fill_mode,
+                cval=const_value
+            )
+    return np.moveaxis(output, (1, 2, 3), (row_axis + 1, col_axis + 1, channel_axis + 1))
+
+
+def _rotation_matrix(rg, h, w):
+    theta = np.pi / 180 * np.random.uniform(-rg, rg)
+    trans_mat = np.array(
+        [[np.cos(theta), -np.sin(theta), 0],
+         [np.sin(theta), np.cos(theta), 0],
+         [0, 0, 1]]
+    )
+    return _trans_mat_offset_center(trans_mat, h, w)
+
+
+def _shift_matrix(wrg, hrg, h, w):
+    tx = np.random.uniform(-hrg, hrg) * h
+    ty = np.random.uniform(-wrg, wrg) * w
+    return np.array([[1, 0, tx],
+                     [0, 1, ty],
+                     [0, 0, 1]])
+
+
+def _shear_matrix(intensity, h, w):
+    shear = np.random.uniform(-intensity, intensity)
+    trans_mat = np.array([[1, -np.sin(shear), 0],
+                          [0, np.cos(shear), 0],
+                          [0, 0, 1]])
+    return _trans_mat_offset_center(trans_mat, h, w)
+
+
+def _zoom_matrix(zoom_range, h, w):
+    if len(zoom_range) != 2:
+        raise ValueError('`zoom_range` should be a tuple or list of two floats. '
+                         'Received arg: ', zoom_range)
+    if zoom_range[0] == 1 and zoom_range[1] == 1:
+        zx, zy = 1, 1
+    else:
+        zx, zy = np.random.uniform(zoom_range[0], zoom_range[1], 2)
+    trans_mat = np.array([[zx, 0, 0],
+                          [0, zy, 0],
+                          [0, 0, 1]])
+    return _trans_mat_offset_center(trans_mat, h, w)
+
+
 def random_rotate(mat,
                   rg,
                   row_axis=0,
@@ -271,14 +771,8 @@ def random_rotate(mat,
              of the input if `mode='constant'`.
     :return: Rotated Numpy image tensor.
     """
-    theta = np.pi / 180 * np.random.uniform(-rg, rg)
-    trans_mat = np.array(
-        [[np.cos(theta), -np.sin(theta), 0],
-         [np.sin(theta), np.cos(theta), 0],
-         [0, 0, 1]]
-    )
     h, w = mat.shape[row_axis], mat.shape[col_axis]
-    trans_mat = _trans_mat_offset_center(trans_mat, h, w)
+    trans_mat = _rotation_matrix(rg, h, w)
     mat = _apply_transform(mat, trans_mat, channel_axis, fill_mode, const_value)
     return mat
 
@@ -307,11 +801,7 @@ def random_shift(mat,
     :return: Shifted Numpy image tensor.
     """
     h, w = mat.shape[row_axis], mat.shape[col_axis]
-    tx = np.random.uniform(-hrg, hrg) * h
-    ty = np.random.uniform(-wrg, wrg) * w
-    trans_mat = np.array([[1, 0, tx],
-                          [0, 1, ty],
-                          [0, 0, 1]])
+    trans_mat = _shift_matrix(wrg, hrg, h, w)
     mat = _apply_transform(mat, trans_mat, channel_axis, fill_mode, const_value)
     return mat
 
@@ -337,12 +827,8 @@ def random_shear(mat,
              of the input if `mode='constant'`.
     :return: Sheared Numpy image tensor.
     """
-    shear = np.random.uniform(-intensity, intensity)
-    trans_mat = np.array([[1, -np.sin(shear), 0],
-                          [0, np.cos(shear), 0],
-                          [0, 0, 1]])
     h, w = mat.shape[row_axis], mat.shape[col_axis]
-    transform_matrix = _trans_mat_offset_center(trans_mat, h, w)
+    transform_matrix = _shear_matrix(intensity, h, w)
     mat = _apply_transform(mat, transform_matrix, channel_axis, fill_mode, const_value)
     return mat
 
@@ -368,19 +854,8 @@ def random_zoom(mat,
              of the input if `mode='constant'`.
     :return: Zoomed Numpy image tensor.
     """
-    zoom_range = zoom_range
-    if len(zoom_range) != 2:
-        raise ValueError('`zoom_range` should be a tuple or list of two floats. '
-                         'Received arg: ', zoom_range)
-    if zoom_range[0] == 1 and zoom_range[1] == 1:
-        zx, zy = 1, 1
-    else:
-        zx, zy = np.random.uniform(zoom_range[0], zoom_range[1], 2)
-    trans_mat = np.array([[zx, 0, 0],
-                          [0, zy, 0],
-                          [0, 0, 1]])
     h, w = mat.shape[row_axis], mat.shape[col_axis]
-    transform_matrix = _trans_mat_offset_center(trans_mat, h, w)
+    transform_matrix = _zoom_matrix(zoom_range, h, w)
     mat = _apply_transform(mat, transform_matrix, channel_axis, fill_mode, const_value)
     return mat
 
@@ -412,35 +887,91 @@ class MatFilter(object):
     def __call__(self, mat):
         raise NotImplementedError()
 
+    def apply_batch(self, mats):
+        """Apply the filter to a batch of images.
+        The subclasses can override this method with a vectorized implementation.
 
-class RandomRotationFilter(MatFilter):
+        :param mats: Numpy array of images.
+        :return: The filtered images.
+        """
+        return np.stack([self.__call__(mat) for mat in mats], axis=0)
+
+
+class AffineFilter(MatFilter):
+    """Affine transform filter
+
+    The subclasses only need to sample the transform matrices, so that the transforms of a batch can be applied
+    together (see "RandomComboFilter.apply_batch()").
+    """
 
     def __init__(self,
-                 rg,
                  row_axis=0,
                  col_axis=1,
                  channel_axis=2,
                  fill_mode='nearest',
                  const_value=0.0):
-        super(RandomRotationFilter, self).__init__(row_axis, col_axis, channel_axis)
-        self._rg = rg
+        super(AffineFilter, self).__init__(row_axis, col_axis, channel_axis)
         self._fill_mode = fill_mode
         self._const_value = const_value
 
+    @property
+    def fill_mode(self):
+        return self._fill_mode
+
+    @property
+    def const_value(self):
+        return self._const_value
+
+    def sample_matrix(self, h, w):
+        """Sample a random transform matrix.
+
+        :param h: Height of the image.
+        :param w: Width of the image.
+        :return: Numpy array with shape (3, 3).
+        """
+        raise NotImplementedError()
+
     def __call__(self, mat):
-        mat = random_rotate(
+        h, w = mat.shape[self._row_axis], mat.shape[self._col_axis]
+        return _apply_transform(
             mat,
-            self._rg,
+            self.sample_matrix(h, w),
+            self._channel_axis,
+            self._fill_mode,
+            self._const_value
+        )
+
+    def apply_batch(self, mats):
+        h, w = mats.shape[self._row_axis + 1], mats.shape[self._col_axis + 1]
+        trans_mats = np.stack([self.sample_matrix(h, w) for _ in range(len(mats))], axis=0)
+        return _apply_transform_batch(
+            mats,
+            trans_mats,
             self._row_axis,
             self._col_axis,
             self._channel_axis,
             self._fill_mode,
             self._const_value
         )
-        return mat
 
 
-class RandomShiftFilter(MatFilter):
+class RandomRotationFilter(AffineFilter):
+
+    def __init__(self,
+                 rg,
+                 row_axis=0,
+                 col_axis=1,
+                 channel_axis=2,
+                 fill_mode='nearest',
+                 const_value=0.0):
+        super(RandomRotationFilter, self).__init__(row_axis, col_axis, channel_axis, fill_mode, const_value)
+        self._rg = rg
+
+    def sample_matrix(self, h, w):
+        return _rotation_matrix(self._rg, h, w)
+
+
+class RandomShiftFilter(AffineFilter):
 
     def __init__(self,
                  wrg,
@@ -450,27 +981,15 @@ class RandomShiftFilter(MatFilter):
                  channel_axis=2,
                  fill_mode='nearest',
                  const_value=0.0):
-        super(RandomShiftFilter, self).__init__(row_axis, col_axis, channel_axis)
+        super(RandomShiftFilter, self).__init__(row_axis, col_axis, channel_axis, fill_mode, const_value)
         self._wrg = wrg
         self._hrg = hrg
-        self._fill_mode = fill_mode
-        self._const_value = const_value
 
-    def __call__(self, mat):
-        mat = random_shift(
-            mat,
-            self._wrg,
-            self._hrg,
-            self._row_axis,
-            self._col_axis,
-            self._channel_axis,
-            self._fill_mode,
-            self._const_value
-        )
-        return mat
+    def sample_matrix(self, h, w):
+        return _shift_matrix(self._wrg, self._hrg, h, w)
 
 
-class RandomShearFilter(MatFilter):
+class RandomShearFilter(AffineFilter):
 
     def __init__(self,
                  intensity,
@@ -479,25 +998,14 @@ class RandomShearFilter(MatFilter):
                  channel_axis=2,
                  fill_mode='nearest',
                  const_value=0.0):
-        super(RandomShearFilter, self).__init__(row_axis, col_axis, channel_axis)
+        super(RandomShearFilter, self).__init__(row_axis, col_axis, channel_axis, fill_mode, const_value)
         self._intensity = intensity
-        self._fill_mode = fill_mode
-        self._const_value = const_value
 
-    def __call__(self, mat):
-        mat = random_shear(
-            mat,
-            self._intensity,
-            self._row_axis,
-            self._col_axis,
-            self._channel_axis,
-            self._fill_mode,
-            self._const_value
-        )
-        return mat
+    def sample_matrix(self, h, w):
+        return _shear_matrix(self._intensity, h, w)
 
 
-class RandomZoomFilter(MatFilter):
+class RandomZoomFilter(AffineFilter):
 
     def __init__(self,
                  zoom_range,
@@ -506,22 +1014,11 @@ class RandomZoomFilter(MatFilter):
                  channel_axis=2,
                  fill_mode='nearest',
                  const_value=0.0):
-        super(RandomZoomFilter, self).__init__(row_axis, col_axis, channel_axis)
+        super(RandomZoomFilter, self).__init__(row_axis, col_axis, channel_axis, fill_mode, const_value)
         self._zoom_range = zoom_range
-        self._fill_mode = fill_mode
-        self._const_value = const_value
 
-    def __call__(self, mat):
-        mat = random_zoom(
-            mat,
-            self._zoom_range,
-            self._row_axis,
-            self._col_axis,
-            self._channel_axis,
-            self._fill_mode,
-            self._const_value
-        )
-        return mat
+    def sample_matrix(self, h, w):
+        return _zoom_matrix(self._zoom_range, h, w)
 
 
 class RandomChannelFilter(MatFilter):
@@ -537,6 +1034,17 @@ class RandomChannelFilter(MatFilter):
         mat = random_channel(mat, self._intensity, self._channel_axis)
         return mat
 
+    def apply_batch(self, mats):
+        n = len(mats)
+        axes = tuple(range(1, mats.ndim))
+        min_x = np.min(mats, axis=axes, keepdims=True)
+        max_x = np.max(mats, axis=axes, keepdims=True)
+        shape = [1] * mats.ndim
+        shape[0] = n
+        shape[self._channel_axis + 1] = mats.shape[self._channel_axis + 1]
+        offsets = np.random.uniform(-self._intensity, self._intensity, shape)
+        return np.clip(mats + offsets, min_x, max_x).astype(mats.dtype)
+
 
 class RandomComboFilter(MatFilter):
 
@@ -557,6 +1065,44 @@ class RandomComboFilter(MatFilter):
         mat = filter_.__call__(mat)
         return mat
 
+    def apply_batch(self, mats):
+        """Apply the filter to a batch of images.
+        A filter is chosen randomly for each image, as "__call__()" does.
+        The transform matrices of all the affine filters are sampled at once, and the images are transformed
+        together (grouped by the fill modes).
+
+        :param mats: Numpy array of images.
+        :return: The filtered images.
+        """
+        mats = np.asarray(mats)
+        output = np.empty_like(mats)
+        choices = [random.randrange(len(self._filter_list)) for _ in range(len(mats))]
+        affine_groups = {}
+        for i, filter_ in enumerate(self._filter_list):
+            index = [j for j, choice in enumerate(choices) if choice == i]
+            if len(index) == 0:
+                continue
+            if isinstance(filter_, AffineFilter):
+                h, w = mats.shape[filter_._row_axis + 1], mats.shape[filter_._col_axis + 1]
+                key = (filter_._row_axis, filter_._col_axis, filter_._channel_axis,
+                       filter_.fill_mode, filter_.const_value)
+                group_index, group_mats = affine_groups.setdefault(key, ([], []))
+                group_index.extend(index)
+                group_mats.extend(filter_.sample_matrix(h, w) for _ in index)
+            else:
+                output[index] = filter_.apply_batch(mats[index])
+        for (row_axis, col_axis, channel_axis, fill_mode, const_value), (index, trans_mats) in affine_groups.items():
+            output[index] = _apply_transform_batch(
+                mats[index],
+                np.stack(trans_mats, axis=0),
+                row_axis,
+                col_axis,
+                channel_axis,
+                fill_mode,
+                const_value
+            )
+        return output
+
 
 def default_augmentation_filter():
     filter_ = RandomComboFilter()
@@ -568,24 +1114,188 @@ def default_augmentation_filter():
 
 
 class AugmentedImageSource(ph.DataSource):
+    """Augmented image data source.
+
+    If num_workers > 0, the batches are augmented by worker processes.
+    A feeder thread in the current process draws the batches from the wrapped data source, so the epochs of the data
+    source are kept, and no sample is repeated by the workers.
+    If the data source can draw the keys of a batch separately ("next_keys()" and "load_batch()", e.g., ImageSource
+    and PackedImageSource), the feeder only sends the keys, and the workers load (decode) and augment the images.
+    Otherwise, the feeder writes the images of each batch into a ring of shared memory buffers, and the workers
+    augment them there.
+    In both cases, the images are not pickled between the processes, and at most "prefetch" batches are prepared in
+    advance, which bounds the memory usage.
+    The batch size should not change once the workers are started, and the filter should keep the image shape.
+    The workers inherit the data source and the filter by forking, so they are started with the "fork" start method
+    (not available on Windows).
+    """
 
     def __init__(self,
                  data_source,
-                 image_col=0):
+                 image_col=0,
+                 filter_=None,
+                 num_workers=0,
+                 prefetch=2):
+        """Augmented image data source.
+
+        :param data_source: The data source to augment.
+        :param image_col: Index of the image column in the batches.
+        :param filter_: MatFilter. Default is "default_augmentation_filter()".
+        :param num_workers: Number of worker processes. 0 means to augment in the current process.
+        :param prefetch: Number of the shared memory buffers, i.e., the max number of prepared batches.
+        """
+        if num_workers < 0:
+            raise ValueError('num_workers should not be negative.')
+        if prefetch < 1:
+            raise ValueError('prefetch should be a positive integer.')
         self._data_source = data_source
         self._image_col = image_col
-        filter_ = RandomComboFilter()
-        self._filter = filter_
-        filter_.add_filter(RandomRotationFilter(30))
-        filter_.add_filter(RandomShearFilter(0.5))
-        filter_.add_filter(RandomZoomFilter((0.8, 1.5)))
-        filter_.add_filter(RandomChannelFilter(0.4))
+        self._filter = filter_ if filter_ is not None else default_augmentation_filter()
+        self._num_workers = num_workers
+        self._prefetch = prefetch
+        self._keyed = hasattr(data_source, 'next_keys') and hasattr(data_source, 'load_batch')
+        #
+        self._batch_size = None
+        self._buffers = None
+        self._free_queue = None
+        self._task_queue = None
+        self._ready_queue = None
+        self._workers = None
+        self._feeder = None
 
     def next_batch(self, size=0):
-        data_batch = self._data_source.next_batch(size)
-        mat_batch = data_batch[self._image_col]
-        mat_batch = np.array(
-            [self._filter(mat) for mat in mat_batch],
-            dtype=np.float32
-        )
+        if self._num_workers == 0:
+            return self._augment(self._data_source.next_batch(size))
+        if self._workers is None:
+            #
+            # The first batch is prepared in the current process, to get the shape of the images.
+            if self._keyed:
+                data_batch = self._data_source.load_batch(self._data_source.next_keys(size))
+            else:
+                data_batch = self._data_source.next_batch(size)
+            data_batch = self._augment(data_batch)
+            self._start_workers(size, data_batch[self._image_col])
+            return data_batch
+        if size != self._batch_size:
+            raise ValueError('The batch size cannot be changed after the workers are started.')
+        result = self._ready_queue.get()
+        if result[0] is None:
+            self.close()
+            raise RuntimeError('Augmentation worker failed.\n%s' % result[1])
+        buffer_id, real_size, data_batch = result
+        mat_batch = self._buffers[buffer_id][:real_size].copy()
+        self._free_queue.put(buffer_id)
         return tuple(col if i != self._image_col else mat_batch for i, col in enumerate(data_batch))
+
+    def _augment(self, data_batch):
+        mat_batch = np.asarray(data_batch[self._image_col], dtype=np.float32)
+        mat_batch = self._filter.apply_batch(mat_batch)
+        return tuple(col if i != self._image_col else mat_batch for i, col in enumerate(data_batch))
+
+    def _start_workers(self, size, mat_batch):
+        import multiprocessing as mp
+        import queue
+        ctx = mp.get_context('fork')
+        self._batch_size = size
+        shape = (len(mat_batch),) + mat_batch.shape[1:]
+        raw_list = [ctx.RawArray('f', int(np.prod(shape))) for _ in range(self._prefetch)]
+        self._buffers = [np.frombuffer(raw, dtype=np.float32).reshape(shape) for raw in raw_list]
+        self._free_queue = queue.Queue()
+        self._task_queue = ctx.Queue()
+        self._ready_queue = ctx.Queue()
+        for buffer_id in range(self._prefetch):
+            self._free_queue.put(buffer_id)
+        seed = np.random.randint(0, 2 ** 31 - self._num_workers)
+        self._workers = []
+        for rank in range(self._num_workers):
+            worker = ctx.Process(
+                target=self._work,
+                args=(seed + rank,)
+            )
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        #
+        # The feeder thread is started after forking the workers.
+        self._feeder = threading.Thread(target=self._feed)
+        self._feeder.daemon = True
+        self._feeder.start()
+
+    def _feed(self):
+        import traceback
+        while True:
+            buffer_id = self._free_queue.get()
+            if buffer_id is None:
+                break
+            try:
+                if self._keyed:
+                    #
+                    # Only the keys are sent. The workers load the images.
+                    self._task_queue.put((buffer_id, self._data_source.next_keys(self._batch_size)))
+                    continue
+                data_batch = self._data_source.next_batch(self._batch_size)
+                mat_batch = np.asarray(data_batch[self._image_col], dtype=np.float32)
+                real_size = len(mat_batch)
+                self._check_fit(mat_batch)
+                self._buffers[buffer_id][:real_size] = mat_batch
+                data_batch = tuple(None if i == self._image_col else col for i, col in enumerate(data_batch))
+                self._task_queue.put((buffer_id, real_size, data_batch))
+            except Exception:
+                self._ready_queue.put((None, traceback.format_exc()))
+                break
+
+    def _check_fit(self, mat_batch):
+        buffer = self._buffers[0]
+        if len(mat_batch) > len(buffer) or mat_batch.shape[1:] != buffer.shape[1:]:
+            raise ValueError(
+                'The batch with shape %s does not fit the buffer with shape %s. '
+                'The batch size and the image shape should not change.' % (mat_batch.shape, buffer.shape)
+            )
+
+    def _work(self, seed):
+        import traceback
+        np.random.seed(seed)
+        random.seed(seed)
+        while True:
+            task = self._task_queue.get()
+            if task is None:
+                break
+            try:
+                if self._keyed:
+                    buffer_id, keys = task
+                    data_batch = self._augment(self._data_source.load_batch(keys))
+                    mat_batch = data_batch[self._image_col]
+                    real_size = len(mat_batch)
+                    self._check_fit(mat_batch)
+                    self._buffers[buffer_id][:real_size] = mat_batch
+                    data_batch = tuple(None if i == self._image_col else col for i, col in enumerate(data_batch))
+                else:
+                    buffer_id, real_size, data_batch = task
+                    buffer = self._buffers[buffer_id][:real_size]
+                    mat_batch = self._filter.apply_batch(buffer)
+                    self._check_fit(mat_batch)
+                    buffer[...] = mat_batch
+                self._ready_queue.put((buffer_id, real_size, data_batch))
+            except Exception:
+                self._ready_queue.put((None, traceback.format_exc()))
+                break
+
+    def close(self):
+        """Stop the feeder thread and the worker processes.
+        """
+        if self._workers is None:
+            return
+        self._free_queue.put(None)
+        self._feeder.join(1)
+        for _ in self._workers:
+            self._task_queue.put(None)
+        for worker in self._workers:
+            worker.join(1)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = None
+        self._feeder = None
+        self._buffers = None
+        self._free_queue = None
+        self._task_queue = None
+        self._ready_queue = None
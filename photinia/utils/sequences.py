@@ -14,12 +14,25 @@ import photinia as ph
 
 class Vocabulary(object):
 
-    def __init__(self, coll, word_field='word', index_field='index'):
+    def __init__(self,
+                 coll,
+                 word_field='word',
+                 index_field='index',
+                 unknown_word='<unk>',
+                 pad_word='<pad>'):
+        """Vocabulary stored in a mongo collection.
+
+        :param coll: The collection. Each document contains a word and its index.
+        :param word_field: Field name of the words.
+        :param index_field: Field name of the indexes.
+        :param unknown_word: The entry used for the words that are not in the vocabulary, if it exists.
+        :param pad_word: The entry used to pad the shorter word lists in a batch, if it exists.
+        """
         self._coll = coll
         self._word_field = word_field
         self._index_field = index_field
         #
-        voc_size = coll.count()
+        voc_size = coll.count_documents({})
         self._voc_size = voc_size
         self._word_dict = {
             doc[word_field]: doc[index_field]
@@ -27,8 +40,16 @@ class Vocabulary(object):
         }
         self._index_dict = {
             index: word
-            for word, index in self._voc_size
+            for word, index in self._word_dict.items()
         }
+        self._unknown_id = self._word_dict.get(unknown_word)
+        self._pad_id = self._word_dict.get(pad_word)
+        #
+        # Id to word table, so that a batch of ids are converted with one numpy index.
+        table_size = max(self._index_dict.keys()) + 1 if self._index_dict else 0
+        self._word_table = np.empty((table_size,), dtype=object)
+        for index, word in self._index_dict.items():
+            self._word_table[index] = word
 
     @property
     def voc_size(self):
@@ -42,6 +63,71 @@ class Vocabulary(object):
     def index_dict(self):
         return self._index_dict
 
+    @property
+    def unknown_id(self):
+        return self._unknown_id
+
+    @property
+    def pad_id(self):
+        return self._pad_id
+
+    def words_to_ids(self, words, unknown_id=None, pad_id=None):
+        """Convert words into ids.
+        The ids are written into one int32 array directly, and a batch is padded with one numpy mask assignment.
+        Use an Embedding layer (or tf.one_hot) in the model to consume the ids, instead of one-hot vectors.
+
+        :param words: A list of words, or a batch (list) of word lists.
+        :param unknown_id: Id of the words that are not in the vocabulary. Default is the id of the unknown word
+            entry (e.g., "<unk>"). A ValueError is raised if an unknown word is met and there is no such id.
+        :param pad_id: Id to pad the shorter word lists in a batch. Default is the id of the pad word entry
+            (e.g., "<pad>"). A ValueError is raised if padding is needed and there is no such id.
+        :return: int32 array with shape (num_words,) for a list of words, or (batch_size, max_len) for a batch.
+        """
+        unknown_id = self._check_id(self._unknown_id if unknown_id is None else unknown_id, 'unknown_id')
+        pad_id = self._check_id(self._pad_id if pad_id is None else pad_id, 'pad_id')
+        if len(words) == 0:
+            return np.zeros((0,), dtype=np.int32)
+        if isinstance(words[0], str):
+            return self._lookup(words, unknown_id)
+        lengths = [len(seq) for seq in words]
+        flat_ids = self._lookup([word for seq in words for word in seq], unknown_id)
+        max_len = max(lengths)
+        if pad_id is None and min(lengths) < max_len:
+            raise ValueError('Padding is needed, but the vocabulary has no pad word and "pad_id" is not given.')
+        ret = np.full((len(words), max_len), 0 if pad_id is None else pad_id, dtype=np.int32)
+        mask = np.arange(ret.shape[1]) < np.reshape(lengths, (-1, 1))
+        ret[mask] = flat_ids
+        return ret
+
+    def _check_id(self, index, name):
+        if index is not None and not 0 <= index < len(self._word_table):
+            raise ValueError('"%s" should be in [0, %d), got %d.' % (name, len(self._word_table), index))
+        return index
+
+    def _lookup(self, words, unknown_id):
+        if unknown_id is None:
+            word_dict = self._word_dict
+            try:
+                return np.fromiter((word_dict[word] for word in words), dtype=np.int32, count=len(words))
+            except KeyError as e:
+                raise ValueError(
+                    'Unknown word "%s", but the vocabulary has no unknown word and "unknown_id" is not given.' %
+                    e.args[0]
+                )
+        get = self._word_dict.get
+        return np.fromiter((get(word, unknown_id) for word in words), dtype=np.int32, count=len(words))
+
+    def ids_to_words(self, ids):
+        """Convert ids into words.
+
+        :param ids: int array with any shape, e.g., (batch_size, seq_len).
+        :return: Array of words (object array) with the same shape.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.size > 0 and (ids.min() < 0 or ids.max() >= len(self._word_table)):
+            raise ValueError('Word ids should be in [0, %d).' % len(self._word_table))
+        return self._word_table[ids]
+
     def words_to_one_hots(self, words):
         one_hot_list = [
             ph.utils.one_hot(self._word_dict[word], self._voc_size, np.float32)
@@ -63,13 +149,31 @@ class WordEmbedding(object):
         self._word_dict = {}
 
     def get_vector(self, word, emb_size=None):
-        if word not in self._word_dict:
-            vec = self._coll.find_one({self._word_field: word}, {self._vec_field: 1})
-            if vec is None:
-                self._word_dict[word] = None if emb_size is None else np.random.normal(0, 1.0, emb_size)
-            else:
-                self._word_dict[word] = pickle.loads(vec[self._vec_field])
-        return self._word_dict[word]
+        return self.get_vectors((word,), emb_size)[0]
+
+    def get_vectors(self, words, emb_size=None, chunk_size=1000):
+        """Get the vectors of the words.
+        The words that have not been cached are fetched with bulk "$in" queries.
+
+        :param words: List of words.
+        :param emb_size: integer. Embedding size. If given, the vectors of the unknown words are random initialized,
+            else they are None.
+        :param chunk_size: Max number of words in one query.
+        :return: List of vectors.
+        """
+        unknown = list({word for word in words if word not in self._word_dict})
+        for start in range(0, len(unknown), chunk_size):
+            chunk = unknown[start:start + chunk_size]
+            cursor = self._coll.find(
+                {self._word_field: {'$in': chunk}},
+                {self._word_field: 1, self._vec_field: 1}
+            )
+            for doc in cursor:
+                self._word_dict[doc[self._word_field]] = pickle.loads(doc[self._vec_field])
+            for word in chunk:
+                if word not in self._word_dict:
+                    self._word_dict[word] = None if emb_size is None else np.random.normal(0, 1.0, emb_size)
+        return [self._word_dict[word] for word in words]
 
     def words_to_vectors(self,
                          words,
@@ -89,20 +193,126 @@ class WordEmbedding(object):
         if lowercase:
             words = [word.lower() for word in words]
         vectors = np.array([
-            vec for vec in (self.get_vector(word, emb_size) for word in words)
+            vec for vec in self.get_vectors(words, emb_size)
             if vec is not None
         ], dtype=np.float32)
         return vectors
 
+    def export(self, output_prefix, dtype=np.float32):
+        """Export the whole embedding collection to local files, which can be loaded by "MappedWordEmbedding":
+
+            "{output_prefix}.npy": The embedding matrix.
+            "{output_prefix}.words": The words, one word per line, in the order of the matrix rows.
+
+        :param output_prefix: Prefix of the output files.
+        :param dtype: Numpy data type of the matrix.
+        :return: Number of the exported words.
+        """
+        doc = self._coll.find_one({}, {self._vec_field: 1})
+        if doc is None:
+            raise ValueError('The embedding collection is empty.')
+        emb_size = len(pickle.loads(doc[self._vec_field]))
+        voc_size = self._coll.count_documents({})
+        matrix = np.lib.format.open_memmap(output_prefix + '.npy', mode='w+', dtype=dtype, shape=(voc_size, emb_size))
+        count = 0
+        with open(output_prefix + '.words', 'wt', encoding='utf-8') as f:
+            for doc in self._coll.find({}, {self._word_field: 1, self._vec_field: 1}):
+                if count >= voc_size:
+                    break
+                matrix[count] = pickle.loads(doc[self._vec_field])
+                f.write(doc[self._word_field].replace('\n', ' ') + '\n')
+                count += 1
+        matrix.flush()
+        del matrix
+        return count
+
+
+class MappedWordEmbedding(object):
+    """Word embedding loaded from the files exported by "WordEmbedding.export()".
+    The matrix is memory-mapped, and a batch of words is looked up with one numpy fancy index.
+    """
+
+    def __init__(self, input_prefix):
+        self._matrix = np.load(input_prefix + '.npy', mmap_mode='r')
+        with open(input_prefix + '.words', 'rt', encoding='utf-8') as f:
+            words = [line.rstrip('\n') for line in f]
+        self._matrix = self._matrix[:len(words)]
+        self._index_dict = {word: index for index, word in enumerate(words)}
+
+    @property
+    def voc_size(self):
+        return len(self._index_dict)
+
+    @property
+    def emb_size(self):
+        return self._matrix.shape[1]
+
+    @property
+    def matrix(self):
+        return self._matrix
+
+    def words_to_ids(self, words):
+        """Convert words into row ids of the matrix.
+
+        :param words: List of words.
+        :return: int64 array. The ids of the unknown words are -1.
+        """
+        get = self._index_dict.get
+        return np.fromiter((get(word, -1) for word in words), dtype=np.int64, count=len(words))
+
+    def get_vectors(self, words, emb_size=None):
+        """Get the vectors of the words.
+
+        :param words: List of words.
+        :param emb_size: Not None means the vectors of the unknown words are random initialized, else they are
+            removed from the result.
+        :return: Array with shape (num_words, emb_size).
+        """
+        ids = self.words_to_ids(words)
+        known = ids >= 0
+        if emb_size is None:
+            return np.asarray(self._matrix[ids[known]], dtype=np.float32)
+        vectors = np.empty((len(ids), self.emb_size), dtype=np.float32)
+        vectors[known] = self._matrix[ids[known]]
+        vectors[~known] = np.random.normal(0, 1.0, (int(np.sum(~known)), self.emb_size))
+        return vectors
+
+    def words_to_vectors(self,
+                         words,
+                         delimiter=None,
+                         lowercase=True,
+                         emb_size=None):
+        """Convert a sentence into word vector list.
+
+        :param words: A string or a list of string.
+        :param delimiter: If "words" is a string, delimiter can be used to split the string into word list.
+        :param lowercase: If the words be converted into lower cases during the process.
+        :param emb_size: integer. Embedding size.
+        :return: A list of vectors.
+        """
+        if delimiter is not None:
+            words = words.split(delimiter)
+        if lowercase:
+            words = [word.lower() for word in words]
+        return self.get_vectors(words, emb_size)
+
 
 def pad_sequences(array_list, dtype=np.float32):
+    """Pad a list of sequences into one batch array.
+    The sequences can be vector sequences (e.g., word vectors), or index sequences (e.g., word ids for an
+    Embedding layer, with dtype=np.int32).
+
+    :param array_list: List of sequences. Each sequence is a list or an array with shape (seq_len, ...).
+    :param dtype: Numpy data type.
+    :return: Array with shape (batch_size, max_seq_len, ...). The padded positions are filled with 0.
+    """
     batch_size = len(array_list)
     seq_len = max(map(len, array_list))
-    word_size = len(array_list[0][0])
-    ret = np.zeros((batch_size, seq_len, word_size), dtype=dtype)
+    elem_shape = np.shape(array_list[0][0])
+    ret = np.zeros((batch_size, seq_len) + elem_shape, dtype=dtype)
     for i, arr in enumerate(array_list):
-        for j, row in enumerate(arr):
-            ret[i, j] = row
+        if len(arr) != 0:
+            ret[i, :len(arr)] = arr
     return ret
 
 # if __name__ == '__main__':
@@ -9,7 +9,6 @@ import photinia as ph
 
 import numpy as np
 import pickle
-import tensorflow as tf
 
 pickle_loads = pickle.loads
 pickle_dumps = pickle.dumps
@@ -86,7 +85,8 @@ def read_variables(var_or_list):
     :param var_or_list: tf.Variable.
     :return: numpy.array value.
     """
-    session = ph.get_session()
+    var = var_or_list[0] if isinstance(var_or_list, (tuple, list)) else var_or_list
+    session = ph.get_session(var.graph)
     return session.run(var_or_list)
 
 
@@ -96,7 +96,8 @@ def write_variables(var_or_list, values):
     :param var_or_list: tf.Variable.
     :param values: numpy.array value.
     """
-    session = ph.get_session()
+    var = var_or_list[0] if isinstance(var_or_list, (tuple, list)) else var_or_list
+    session = ph.get_session(var.graph)
     if isinstance(var_or_list, (tuple, list)):
         for var, value in zip(var_or_list, values):
             var.load(value, session)
@@ -105,6 +106,7 @@ def write_variables(var_or_list, values):
 
 
 def get_operation(name):
+    import tensorflow as tf
     return tf.get_default_graph().get_operation_by_name(name)
 
 
@@ -129,12 +131,14 @@ def get_tensor(name):
     :param name: Tensor name (must be full name).
     :return: The tensor.
     """
+    import tensorflow as tf
     if name.rfind(':') == -1:
         name += ':0'
     return tf.get_default_graph().get_tensor_by_name(name)
 
 
 def get_variable(name):
+    import tensorflow as tf
     if name.rfind(':') == -1:
         name += ':0'
     for var in tf.get_local_variable():
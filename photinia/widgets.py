@@ -5,6 +5,7 @@
 @since: 2016-11-11
 """
 
+import collections
 import math
 import threading
 
@@ -72,7 +73,9 @@ class Widget(object):
     """
 
     LOCK = threading.Semaphore(1)
-    INSTANCES = dict()
+    #
+    # Graph to {full_name: widget} dictionary.
+    INSTANCES = collections.defaultdict(dict)
 
     def __init__(self,
                  name=None,
@@ -89,6 +92,7 @@ class Widget(object):
             if len(name.strip()) != len(name) or name == '':
                 raise ValueError('Widget name cannot be empty or contain space characters.')
         self._name = name
+        self._graph = None
         self._scope = ''
         self._full_name = None
         self._prefix = None
@@ -104,6 +108,16 @@ class Widget(object):
     def built(self):
         return self._built
 
+    @property
+    def graph(self):
+        """Get the graph in which the widget is built.
+
+        Returns:
+            tf.Graph: The graph.
+
+        """
+        return self._graph
+
     def build(self):
         """Build the widget.
         The main purpose of this function is to create the trainable variables (parameters) for the widget.
@@ -120,6 +134,7 @@ class Widget(object):
         # else:
         #
         # Build WITH scope.
+        self._graph = tf.get_default_graph()
         self._scope = tf.get_variable_scope().name
         if self._scope == '':
             self._full_name = self._name
@@ -133,9 +148,10 @@ class Widget(object):
             self._build()
             self._built = True
         with Widget.LOCK:
-            if self._full_name in Widget.INSTANCES:
+            instances = Widget.INSTANCES[self._graph]
+            if self._full_name in instances:
                 raise ValueError('Duplicated widget name %s.' % self._full_name)
-            Widget.INSTANCES[self._full_name] = self
+            instances[self._full_name] = self
         return self
 
     def _build(self):
@@ -194,7 +210,7 @@ class Widget(object):
         if self._name is None:
             return list()
         prefix = self._prefix
-        global_vars = tf.global_variables()
+        global_vars = self._graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
         return [var for var in global_vars if var.name.startswith(prefix)]
 
     def get_trainable_variables(self):
@@ -206,7 +222,7 @@ class Widget(object):
         """
         if self._name is None:
             return list()
-        trainable_vars = tf.trainable_variables()
+        trainable_vars = self._graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
         return [var for var in trainable_vars if var.name.startswith(self._prefix)]
 
     @property
@@ -242,7 +258,7 @@ class Widget(object):
         """
         var_list = self.get_trainable_variables()
         param_dict = {var.name: var for var in var_list}
-        param_dict = settings.get_session().run(param_dict)
+        param_dict = settings.get_session(self._graph).run(param_dict)
         return param_dict
 
     def set_parameters(self, param_dict, strict=True):
@@ -259,7 +275,7 @@ class Widget(object):
         """
         var_list = self.get_trainable_variables()
         var_dict = {var.name: var for var in var_list}
-        session = settings.get_session()
+        session = settings.get_session(self._graph)
         for name, value in param_dict.items():
             if name not in var_dict:
                 if strict:
@@ -270,7 +286,7 @@ class Widget(object):
     def get_operation(self, name):
         name = self._prefix + name
         try:
-            return tf.get_default_graph().get_operation_by_name(name)
+            return self._graph.get_operation_by_name(name)
         except KeyError:
             return None
 
@@ -280,7 +296,7 @@ class Widget(object):
         else:
             name = self._prefix + name
         try:
-            return tf.get_default_graph().get_tensor_by_name(name)
+            return self._graph.get_tensor_by_name(name)
         except KeyError:
             return None
 
@@ -289,20 +305,22 @@ class Widget(object):
             name = '%s%s:0' % (self._prefix, name)
         else:
             name = self._prefix + name
-        for var in tf.global_variables():
+        for var in self._graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES):
             if name == var.name:
                 return var
         return None
 
     def __getattr__(self, name):
         name = self._prefix + name
+        graph = self._graph if self._graph is not None else tf.get_default_graph()
         with Widget.LOCK:
-            if name in Widget.INSTANCES:
-                return Widget.INSTANCES[name]
+            instances = Widget.INSTANCES.get(graph, {})
+            if name in instances:
+                return instances[name]
         if name.rfind(':') == -1:
             name += ':0'
         try:
-            return tf.get_default_graph().get_tensor_by_name(name)
+            return graph.get_tensor_by_name(name)
         except KeyError:
             return None
 
@@ -399,6 +417,205 @@ class Linear(Widget):
         return y
 
 
+class Embedding(Widget):
+    """Embedding layer.
+    y = W[x]
+    """
+
+    def __init__(self,
+                 name,
+                 voc_size,
+                 emb_size,
+                 w_init=initializers.GlorotUniform()):
+        """Embedding layer.
+
+        Equivalent to a Linear layer without bias applied on one hot vectors, but the input is given as indices.
+        The lookup only touches the selected rows, so the gradient of the embedding matrix is
+        tf.IndexedSlices and the optimizer updates only these rows.
+
+        Args:
+            name (str): Widget name.
+            voc_size (int): Vocabulary size.
+            emb_size (int): Embedding size.
+            w_init (initializers.Initializer): Embedding matrix initializer.
+
+        """
+        self._voc_size = voc_size
+        self._emb_size = emb_size
+        self._w_init = w_init
+        super(Embedding, self).__init__(name)
+
+    @property
+    def voc_size(self):
+        return self._voc_size
+
+    @property
+    def input_size(self):
+        return self._voc_size
+
+    @property
+    def emb_size(self):
+        return self._emb_size
+
+    @property
+    def output_size(self):
+        return self._emb_size
+
+    def _build(self):
+        """Build the embedding layer.
+        One parameter: the embedding matrix with shape (voc_size, emb_size).
+
+        """
+        self._w = tf.Variable(
+            self._w_init.build(
+                shape=(self._voc_size, self._emb_size)
+            ),
+            dtype=settings.D_TYPE,
+            name='w'
+        )
+
+    @property
+    def w(self):
+        return self._w
+
+    def _setup(self, x):
+        """Setup the layer.
+
+        Args:
+            x (tf.Tensor): Integer index tensor with any shape.
+
+        Returns:
+            tf.Tensor: Output tensor. The shape is x.shape + (emb_size,).
+
+        """
+        return tf.nn.embedding_lookup(self._w, x)
+
+
+class SampledSoftmax(Widget):
+    """Softmax output layer for large vocabularies.
+    Train with candidate sampling (sampled softmax or NCE), evaluate with the exact full softmax.
+    """
+
+    def __init__(self,
+                 name,
+                 input_size,
+                 voc_size,
+                 num_sampled=64,
+                 loss_type='sampled_softmax',
+                 w_init=initializers.GlorotUniform(),
+                 b_init=initializers.Zeros()):
+        """Softmax output layer for large vocabularies.
+
+        Args:
+            name (str): Widget name.
+            input_size (int): Input size.
+            voc_size (int): Vocabulary size, i.e., number of classes.
+            num_sampled (int): Number of candidates sampled per batch during training.
+            loss_type (str): Sampled loss type. Should be one of {"sampled_softmax", "nce"}.
+                Default is "sampled_softmax".
+            w_init (initializers.Initializer): Weight initializer.
+            b_init (initializers.Initializer): Bias initializer.
+
+        """
+        self._input_size = input_size
+        self._voc_size = voc_size
+        self._num_sampled = num_sampled
+        loss_type = loss_type.lower()
+        if loss_type not in {'sampled_softmax', 'nce'}:
+            raise ValueError('loss_type should be one of {"sampled_softmax", "nce"}, '
+                             'but got %s' % loss_type)
+        self._loss_type = loss_type
+        self._w_init = w_init
+        self._b_init = b_init
+        super(SampledSoftmax, self).__init__(name)
+
+    @property
+    def input_size(self):
+        return self._input_size
+
+    @property
+    def voc_size(self):
+        return self._voc_size
+
+    @property
+    def output_size(self):
+        return self._voc_size
+
+    @property
+    def num_sampled(self):
+        return self._num_sampled
+
+    @property
+    def loss_type(self):
+        return self._loss_type
+
+    def _build(self):
+        """Build the output layer.
+        Two parameters: weight with shape (voc_size, input_size) and bias with shape (voc_size,).
+
+        """
+        self._w = tf.Variable(
+            self._w_init.build(
+                shape=(self._voc_size, self._input_size)
+            ),
+            dtype=settings.D_TYPE,
+            name='w'
+        )
+        self._b = tf.Variable(
+            self._b_init.build(
+                shape=(self._voc_size,)
+            ),
+            dtype=settings.D_TYPE,
+            name='b'
+        )
+
+    @property
+    def w(self):
+        return self._w
+
+    @property
+    def b(self):
+        return self._b
+
+    def _setup(self, x, labels=None, sampled=True):
+        """Setup the output layer.
+
+        If labels is None, the full logits are computed for all elements of x with one batched matmul.
+        Otherwise, the loss of each element is returned. The loss is computed over num_sampled candidates if
+        sampled is True (training), or over the whole vocabulary if sampled is False (evaluation).
+
+        Args:
+            x (tf.Tensor): Input tensor with shape (..., input_size), e.g., (batch_size, seq_length, input_size).
+            labels (tf.Tensor): Integer label tensor with shape x.shape[:-1].
+            sampled (bool): Use candidate sampling or not.
+
+        Returns:
+            tf.Tensor: Logits with shape x.shape[:-1] + (voc_size,) if labels is None,
+                else the loss with shape x.shape[:-1].
+
+        """
+        if labels is None or not sampled:
+            logits = tf.tensordot(x, self._w, ((x.shape.ndims - 1,), (1,))) + self._b
+            if labels is None:
+                return logits
+            return tf.nn.sparse_softmax_cross_entropy_with_logits(
+                labels=tf.cast(labels, tf.int64),
+                logits=logits
+            )
+        flat_x = tf.reshape(x, (-1, self._input_size))
+        flat_labels = tf.reshape(tf.cast(labels, tf.int64), (-1, 1))
+        loss_fn = tf.nn.sampled_softmax_loss if self._loss_type == 'sampled_softmax' else tf.nn.nce_loss
+        loss = loss_fn(
+            weights=self._w,
+            biases=self._b,
+            labels=flat_labels,
+            inputs=flat_x,
+            num_sampled=self._num_sampled,
+            num_classes=self._voc_size
+        )
+        return tf.reshape(loss, tf.shape(labels))
+
+
 class Dropout(Widget):
 
     def __init__(self, name, keep_prob=None):
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""
+@author: xi
+@since: 2026-10-18
+"""
+
+import os
+
+import numpy as np
+
+import photinia as ph
+from photinia.utils import images
+
+
+def _make_source(size=200):
+    mats = np.random.uniform(-1, 1, (size, 8, 8, 3)).astype(np.float32)
+    ids = np.arange(size)
+    return ph.Dataset(mats, ids)
+
+
+def test_workers_do_not_repeat_samples():
+    source = images.AugmentedImageSource(_make_source(), num_workers=2, prefetch=3)
+    try:
+        id_list = []
+        for _ in range(8):
+            mat_batch, id_batch = source.next_batch(5)
+            assert mat_batch.shape == (5, 8, 8, 3)
+            assert mat_batch.dtype == np.float32
+            id_list.extend(id_batch.tolist())
+    finally:
+        source.close()
+    #
+    # 40 samples are far less than one epoch (200), so no id should appear twice.
+    assert len(id_list) == len(set(id_list)) == 40
+
+
+def test_in_process_batch():
+    source = images.AugmentedImageSource(_make_source(20))
+    mat_batch, id_batch = source.next_batch(10)
+    assert mat_batch.shape == (10, 8, 8, 3)
+    assert len(set(id_batch.tolist())) == 10
+
+
+class _KeyedSource(ph.DataSource):
+
+    def __init__(self, size=200):
+        self._mats = np.random.uniform(-1, 1, (size, 8, 8, 3)).astype(np.float32)
+        self._dataset = ph.Dataset(np.arange(size)).shuffle()
+
+    def next_batch(self, size=0):
+        return self.load_batch(self.next_keys(size))
+
+    def next_keys(self, size=0):
+        ids, = self._dataset.next_batch(size)
+        return ids
+
+    def load_batch(self, ids):
+        return self._mats[ids], ids, np.full((len(ids),), os.getpid())
+
+
+def test_workers_load_keyed_batches():
+    source = images.AugmentedImageSource(_KeyedSource(), num_workers=2, prefetch=3)
+    try:
+        id_list = []
+        pid_set = set()
+        for _ in range(8):
+            mat_batch, id_batch, pid_batch = source.next_batch(5)
+            assert mat_batch.shape == (5, 8, 8, 3)
+            id_list.extend(id_batch.tolist())
+            pid_set.update(pid_batch.tolist())
+    finally:
+        source.close()
+    assert len(id_list) == len(set(id_list)) == 40
+    #
+    # Except the first batch, the images are loaded by the workers.
+    assert len(pid_set - {os.getpid()}) > 0